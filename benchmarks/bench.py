@@ -0,0 +1,279 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Benchmarks of how Skal scales with the size of an app.
+
+Synthetic apps of N modules with M commands of K arguments each are generated
+as a SkalApp subclass, command modules, subcommand modules and a package, and
+each scenario is measured in fresh interpreters: the time to import the
+decorators, as a command module does, and then the app, to create the app, to
+run the last command and to render the main help, and the peak memory. The
+best of the repeated runs is reported.
+
+Usage: python benchmarks/bench.py [-n N] [-m M] [-k K] [--save FILE]
+                                  [--compare FILE]
+
+Results saved with --save are a baseline that later runs can be compared
+with, a metric more than the threshold worse than the baseline, and more than
+a millisecond or half a megabyte, is reported as a regression and the exit
+code is then 1.
+
+"""
+
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'class': "benchapp.BenchApp()",
+    'modules': "SkalApp(command_modules=MODULES, **OPTIONS)",
+    'subcommands': "SkalApp(subcommand_modules=MODULES, **OPTIONS)",
+    'package': "SkalApp(subcommand_packages=['benchpkg'], **OPTIONS)",
+    'lazy-parsers': "SkalApp(command_modules=MODULES, lazy_parsers=True, "
+                    "**OPTIONS)",
+    'lazy': "SkalApp(subcommand_modules=MODULES, lazy=True, "
+            "lazy_parsers=True, **OPTIONS)",
+    'manifest': "SkalApp(subcommand_modules=MODULES, lazy=True, "
+                "lazy_parsers=True, manifest=MANIFEST, **OPTIONS)",
+    'static': "SkalApp(subcommand_modules=MODULES, lazy=True, "
+              "lazy_parsers=True, static=True, **OPTIONS)",
+}
+
+METRICS = [
+    ('decorators', 'decorators ms'),
+    ('import', 'import ms'),
+    ('init', 'init ms'),
+    ('run', 'run ms'),
+    ('help', 'help ms'),
+    ('memory', 'memory KB'),
+]
+
+# Changes smaller than these are noise, not regressions
+NOISE = {'decorators': 1.0, 'import': 1.0, 'init': 1.0, 'run': 1.0,
+         'help': 1.0, 'memory': 512}
+
+MEASURE = r'''
+import os
+import sys
+import json
+import time
+import resource
+import StringIO
+sys.path[:0] = [%(root)r, %(tempdir)r]
+MODULES = ['benchmod%%d' %% i for i in range(%(modules)d)]
+MANIFEST = os.path.join(%(tempdir)r, 'manifest.json')
+OPTIONS = {'description': 'benchmark app', 'version': '1.0'}
+start = time.time()
+from skal import command
+result = {'decorators': time.time() - start}
+start = time.time()
+from skal import SkalApp
+%(imports)s
+result['import'] = time.time() - start
+stdout = sys.stdout
+sys.stdout = StringIO.StringIO()
+start = time.time()
+app = %(create)s
+result['init'] = time.time() - start
+start = time.time()
+app.run(%(args)r)
+result['run'] = time.time() - start
+app = %(create)s
+start = time.time()
+try:
+    app.run(['-h'])
+except SystemExit:
+    pass
+result['help'] = time.time() - start
+sys.stdout = stdout
+result['memory'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps(result))
+'''
+
+
+def generate(path, modules, commands, arguments):
+    """Writes the synthetic modules, package and app class to path"""
+    def command_source(name, doc):
+        lines = ['@command({']
+        for k in range(arguments):
+            lines.append("    '--arg%d': {'help': 'argument %d'}," % (k, k))
+        lines.append('})')
+        lines.append('def %s(**args):' % name)
+        lines.append('    """%s"""' % doc)
+        lines.append('    return None')
+        return '\n'.join(lines) + '\n\n\n'
+
+    package = os.path.join(path, 'benchpkg')
+    os.mkdir(package)
+    with open(os.path.join(package, '__init__.py'), 'w') as f:
+        f.write('"""benchmark package"""\n')
+    for i in range(modules):
+        source = ('"""benchmark module %d"""\n\n'
+                  'from skal import command\n\n\n' % i)
+        for j in range(commands):
+            source += command_source(
+                'cmd_%d_%d' % (i, j), 'command %d of module %d' % (j, i))
+        for directory in (path, package):
+            with open(os.path.join(directory, 'benchmod%d.py' % i), 'w') as f:
+                f.write(source)
+
+    source = ['"""benchmark app"""', '', 'from skal import SkalApp, command',
+              '', '', "__version__ = '1.0'", '', '',
+              'class BenchApp(SkalApp):', '    """benchmark app"""', '']
+    for i in range(modules):
+        for j in range(commands):
+            for line in command_source('cmd_%d_%d' % (i, j),
+                                       'command %d' % j).splitlines()[:-1]:
+                line = line.replace('(**args)', '(self, **args)')
+                source.append('    ' + line if line else '')
+    with open(os.path.join(path, 'benchapp.py'), 'w') as f:
+        f.write('\n'.join(source) + '\n')
+
+
+def measure(scenario, path, modules, commands):
+    """Runs a scenario in a fresh interpreter, returns its metrics"""
+    last = 'cmd_%d_%d' % (modules - 1, commands - 1)
+    if scenario in ('class', 'modules', 'lazy-parsers'):
+        args = [last]
+    elif scenario == 'package':
+        args = ['benchpkg', 'benchmod%d' % (modules - 1), last]
+    else:
+        args = ['benchmod%d' % (modules - 1), last]
+    script = MEASURE % {
+        'root': ROOT,
+        'tempdir': path,
+        'modules': modules,
+        'create': SCENARIOS[scenario],
+        'imports': 'import benchapp' if scenario == 'class' else '',
+        'args': args,
+    }
+    output = subprocess.check_output([sys.executable, '-c', script])
+    return json.loads(output)
+
+
+def run(scenarios, modules, commands, arguments, repeat):
+    """Returns the best metrics of each scenario over repeat runs"""
+    path = tempfile.mkdtemp()
+    try:
+        generate(path, modules, commands, arguments)
+        results = {}
+        for scenario in scenarios:
+            if scenario == 'manifest':
+                # Only the runs with an up to date manifest are measured
+                measure(scenario, path, modules, commands)
+            runs = [measure(scenario, path, modules, commands)
+                    for _ in range(repeat)]
+            best = {}
+            for key, _ in METRICS:
+                best[key] = min(r[key] for r in runs)
+                if key != 'memory':
+                    best[key] *= 1000
+            results[scenario] = best
+        return results
+    finally:
+        shutil.rmtree(path)
+
+
+def report(results, baseline=None, threshold=0.1):
+    """Writes a table of results, compared with a baseline if given.
+
+    Returns the list of (scenario, metric) that regressed.
+
+    """
+    regressions = []
+    sys.stdout.write('%-12s' % 'scenario')
+    for _, title in METRICS:
+        sys.stdout.write(' %18s' % title)
+    sys.stdout.write('\n')
+    for scenario in sorted(results):
+        sys.stdout.write('%-12s' % scenario)
+        for key, _ in METRICS:
+            value = results[scenario][key]
+            old = (baseline or {}).get(scenario, {}).get(key)
+            if not old:
+                sys.stdout.write(' %18.1f' % value)
+                continue
+            change = float(value - old) / old
+            mark = ' '
+            if change > threshold and value - old > NOISE[key]:
+                mark = '!'
+                regressions.append((scenario, key))
+            sys.stdout.write(' %9.1f %+6.0f%%%s' % (
+                value, change * 100, mark))
+        sys.stdout.write('\n')
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--modules', type=int, default=20,
+                        help='number of modules (default 20)')
+    parser.add_argument('-m', '--commands', type=int, default=10,
+                        help='number of commands per module (default 10)')
+    parser.add_argument('-k', '--arguments', type=int, default=5,
+                        help='number of arguments per command (default 5)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='runs of each scenario (default 5)')
+    parser.add_argument('-s', '--scenario', action='append',
+                        choices=sorted(SCENARIOS),
+                        help='scenario to run, may be repeated (default all)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change reported as a regression '
+                             '(default 0.1)')
+    args = parser.parse_args(args)
+
+    params = {'modules': args.modules, 'commands': args.commands,
+              'arguments': args.arguments}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        if saved['params'] != params:
+            sys.stderr.write('Error: baseline is of %s, not %s\n' % (
+                saved['params'], params))
+            return 2
+        baseline = saved['results']
+
+    scenarios = args.scenario or sorted(SCENARIOS)
+    results = run(scenarios, args.modules, args.commands, args.arguments,
+                  args.repeat)
+    regressions = report(results, baseline, args.threshold)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'params': params, 'results': results}, f, indent=2,
+                      sort_keys=True)
+    if regressions:
+        sys.stderr.write('Error: %d regressions: %s\n' % (
+            len(regressions),
+            ', '.join('%s %s' % r for r in regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
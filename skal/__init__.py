@@ -13,5 +13,32 @@
 # limitations under the License.
 
 
+import sys
+import types
+
 from .version import *
-from .core import *
+from .decorators import command, default
+from .imports import lazy_import
+
+
+class _Package(types.ModuleType):
+    """The skal package, importing skal.core when SkalApp is first used.
+
+    Command modules importing the decorators then don't pay for argparse and
+    the rest of the machinery of an app.
+
+    """
+    def __getattr__(self, name):
+        if name == 'SkalApp':
+            from .core import SkalApp
+            return SkalApp
+        raise AttributeError("'module' object has no attribute '%s'" % name)
+
+
+# Python 2 modules can't have properties, so the package is replaced by an
+# instance of _Package, keeping the original alive for its globals
+_package = _Package(__name__, __doc__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+_package.__all__ = ['SkalApp', 'command', 'default', 'lazy_import']
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
@@ -0,0 +1,198 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Caching the results of commands on disk.
+
+A command with the cache option of the command decorator is keyed by its
+name and arguments. The output, errors and return value of a successful
+call are written to a file of the cache directory named by the hash of the
+key, and a later call with the same key replays them instead of running the
+command, while the entry is younger than the time to live of the command.
+
+The files used last are kept when the cache grows over its size, the others
+are removed, oldest first. A replayed entry counts as used.
+
+"""
+
+
+import os
+import sys
+import json
+import time
+import errno
+import hashlib
+
+
+DEFAULT_SIZE = 32 * 1024 * 1024
+
+
+class ResultCache(object):
+    """Results of commands, one file per key in a directory"""
+    def __init__(self, path, size=DEFAULT_SIZE):
+        """Keyword arguments:
+        path -- Directory of the cache, created when first written to
+        size -- Bytes the files may take before the least recently used
+                are removed (default DEFAULT_SIZE)
+
+        """
+        self.path = path
+        self.size = size
+
+    def call(self, key, ttl, function):
+        """Returns the result of function, replayed from the cache if fresh.
+
+        On a miss function is called with its output and errors recorded as
+        they are written, and they are stored with its result unless it
+        failed. A ttl of True never expires.
+
+        """
+        entry = self.get(key, ttl)
+        if entry is not None:
+            sys.stdout.write(entry['output'].encode('latin-1'))
+            sys.stderr.write(entry['errors'].encode('latin-1'))
+            return entry['result']
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = _Recorder(stdout), _Recorder(stderr)
+        try:
+            result = function()
+            output, errors = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        # Other values are exit codes of failures, like sys.exit gives
+        if not isinstance(result, (int, long)) or not result:
+            self.put(key, output, errors, result)
+        return result
+
+    def get(self, key, ttl):
+        """Returns the entry of key, or None if missing or expired"""
+        path = self.__file(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        if ttl is not True and time.time() - entry['time'] > ttl:
+            _remove(path)
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, output, errors, result):
+        """Stores an entry and removes the least recently used over size"""
+        try:
+            # Output is bytes, stored as the characters of the same codes
+            data = json.dumps({
+                'key': key,
+                'time': time.time(),
+                'output': output.decode('latin-1'),
+                'errors': errors.decode('latin-1'),
+                'result': result,
+            })
+        except (TypeError, ValueError) as e:
+            sys.stderr.write('Warning: could not cache result: %s\n' % e)
+            return
+        path = self.__file(key)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.rename(tmp, path)
+        except (IOError, OSError) as e:
+            sys.stderr.write('Warning: could not write result cache: %s\n' %
+                             e)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until within size"""
+        entries = self.__entries()
+        total = sum(stat.st_size for _, stat in entries)
+        for path, stat in sorted(entries, key=lambda e: e[1].st_mtime):
+            if total <= self.size:
+                break
+            _remove(path)
+            total -= stat.st_size
+
+    def purge(self):
+        """Removes all entries, returns the number removed"""
+        entries = self.__entries()
+        for path, _ in entries:
+            _remove(path)
+        return len(entries)
+
+    def __file(self, key):
+        return os.path.join(self.path,
+                            hashlib.sha1(key).hexdigest() + '.json')
+
+    def __entries(self):
+        """Returns (path, stat) of each entry file"""
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                entries.append((path, os.stat(path)))
+            except OSError:
+                pass
+        return entries
+
+
+def key(name, args):
+    """Returns the cache key of a command name and its arguments"""
+    return json.dumps([name, args], sort_keys=True, default=repr)
+
+
+class _Recorder(object):
+    """A write only file writing to a stream and recording what it wrote"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.chunks = []
+        self.softspace = 0
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def write(self, data):
+        self.stream.write(data)
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.chunks.append(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
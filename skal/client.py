@@ -0,0 +1,159 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Thin client for a SkalApp served on a unix socket.
+
+Usage: python -m skal.client SOCKET [ARGS...]
+       python -m skal.client --stats SOCKET
+
+The arguments, working directory and environment are sent to the server,
+which runs the command and relays its output, input and exit code. Messages
+in both directions are frames of a one byte kind, a four byte length and the
+data.
+
+"""
+
+
+import os
+import sys
+import json
+import socket
+import struct
+
+
+def call(path, args, stdin=None, stdout=None, stderr=None,
+         cwd=None, env=None):
+    """Runs a command line in the app served at path.
+
+    Returns the exit code of the command.
+
+    Keyword arguments:
+    stdin  -- File to read input from (default sys.stdin)
+    stdout -- File to write output to (default sys.stdout)
+    stderr -- File to write errors to (default sys.stderr)
+    cwd    -- Working directory of the command (default the current)
+    env    -- Environment of the command (default the current)
+
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    try:
+        send(sock, 'a', json.dumps({
+            'argv': list(args),
+            'cwd': cwd or os.getcwd(),
+            'env': dict(os.environ if env is None else env),
+            'tty': [_isatty(f) for f in (stdin, stdout, stderr)],
+        }))
+        while True:
+            try:
+                kind, data = recv(sock)
+            except KeyboardInterrupt:
+                send(sock, 'c')
+                continue
+            if kind is None:
+                stderr.write('Error: connection to server lost\n')
+                return 1
+            elif kind == 'o':
+                stdout.write(data)
+                stdout.flush()
+            elif kind == 'e':
+                stderr.write(data)
+                stderr.flush()
+            elif kind == 'r':
+                send(sock, 'i', _read(stdin, int(data)))
+            elif kind == 'x':
+                return int(data)
+    finally:
+        sock.close()
+
+
+def stats(path):
+    """Returns the dict of statistics of the server at path"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    try:
+        send(sock, 's')
+        kind, data = recv(sock)
+        return json.loads(data)
+    finally:
+        sock.close()
+
+
+def send(sock, kind, data=''):
+    sock.sendall(struct.pack('!cI', kind, len(data)) + data)
+
+
+def recv(sock):
+    """Returns (kind, data) of the next frame, or (None, None) at the end"""
+    header = _recv_exactly(sock, 5)
+    if not header:
+        return None, None
+    kind, length = struct.unpack('!cI', header)
+    data = _recv_exactly(sock, length)
+    if data is None:
+        return None, None
+    return kind, data
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+def _read(f, size):
+    try:
+        return os.read(f.fileno(), size)
+    except (AttributeError, ValueError):
+        return f.read(size)
+
+
+def _isatty(f):
+    try:
+        return f.isatty()
+    except AttributeError:
+        return False
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    if not args or args == ['--stats']:
+        sys.stderr.write('Usage: python -m skal.client SOCKET [ARGS...]\n'
+                         '       python -m skal.client --stats SOCKET\n')
+        return 2
+    try:
+        if args[0] == '--stats':
+            path = args[1]
+            for key, value in sorted(stats(path).items()):
+                sys.stdout.write('%s: %s\n' % (key, value))
+            return 0
+        path = args[0]
+        return call(path, args[1:])
+    except socket.error as e:
+        sys.stderr.write('Error: could not connect to "%s": %s\n' % (
+            path, e))
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Shell completion of a SkalApp from an index of its parsers.
+
+Usage: SKAL_COMPLETION=bash|zsh|fish python myapp.py > completion-script
+       python -m skal.completion INDEX [WORDS...]
+
+Run with SKAL_COMPLETION set, an app writes an index of its commands,
+subcommands and options, and the files they come from, and prints a script
+for the shell. The script completes the words typed so far with the index
+only, without importing any command module. When one of the files has
+changed the app is run again, with SKAL_COMPLETION=index, to refresh the
+index.
+
+The index is written to the path in SKAL_COMPLETION_INDEX, by default
+~/.cache/skal/PROG.json.
+
+"""
+
+
+import os
+import re
+import sys
+import json
+import inspect
+import subprocess
+
+
+SCRIPTS = {
+    'bash': '''\
+_skal_%(name)s() {
+    local IFS=$'\\n'
+    COMPREPLY=($(%(complete)s "${COMP_WORDS[@]:1:$COMP_CWORD}"))
+}
+complete -o default -F _skal_%(name)s %(prog)s
+''',
+    'zsh': '''\
+#compdef %(prog)s
+_skal_%(name)s() {
+    local -a candidates
+    candidates=("${(@f)$(%(complete)s "${(@)words[2,$CURRENT]}")}")
+    compadd -a candidates
+}
+compdef _skal_%(name)s %(prog)s
+''',
+    'fish': '''\
+function __skal_%(name)s
+    set -l words (commandline -opc) (commandline -ct)
+    %(complete)s $words[2..-1]
+end
+complete -c %(prog)s -f -a '(__skal_%(name)s)'
+''',
+}
+
+
+def generate(parser, shell, stream=None):
+    """Writes the index of parser and the completion script of shell.
+
+    The shell 'index' only writes the index. Returns the exit code.
+
+    Keyword arguments:
+    stream -- File to write the script to (default sys.stdout)
+
+    """
+    if shell != 'index' and shell not in SCRIPTS:
+        sys.stderr.write('Error: no completion for shell "%s", use one of '
+                         '%s\n' % (shell, ', '.join(sorted(SCRIPTS))))
+        return 1
+    path = os.environ.get('SKAL_COMPLETION_INDEX') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'skal', parser.prog + '.json')
+    path = os.path.abspath(path)
+    sources = set()
+    tree = _index(parser, sources)
+    script = os.path.abspath(sys.argv[0])
+    if os.path.isfile(script):
+        sources.add(script)
+    index = {
+        'command': [sys.executable, script] + sys.argv[1:],
+        'sources': dict((p, _stamp(p)) for p in sources),
+        'tree': tree,
+    }
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.rename(path + '.tmp', path)
+    if shell != 'index':
+        (stream or sys.stdout).write(SCRIPTS[shell] % {
+            'name': re.sub(r'\W', '_', parser.prog),
+            'prog': parser.prog,
+            'complete': '%s -m skal.completion %s' % (sys.executable, path),
+        })
+    return 0
+
+
+def complete(path, words):
+    """Returns the completions of the last of words from the index at path.
+
+    The index is refreshed first if any of its files changed.
+
+    """
+    index = _load(path)
+    if index and _stale(index):
+        with open(os.devnull, 'w') as devnull:
+            env = dict(os.environ, SKAL_COMPLETION='index',
+                       SKAL_COMPLETION_INDEX=path)
+            subprocess.call(index['command'], env=env, stdout=devnull,
+                            stderr=devnull)
+        index = _load(path)
+    if not index:
+        return []
+    node = index['tree']
+    expect = None
+    for word in words[:-1]:
+        if expect:
+            expect = None
+        elif word.startswith('-'):
+            if '=' not in word:
+                expect = node['options'].get(word)
+        elif word in node['commands']:
+            node = node['commands'][word]
+    current = words[-1] if words else ''
+    if isinstance(expect, list):
+        candidates = expect
+    elif expect:
+        # A value the index knows nothing about, left to the shell
+        candidates = []
+    elif current.startswith('-'):
+        candidates = node['options']
+    else:
+        candidates = node['commands']
+    return sorted(c for c in candidates if c.startswith(current))
+
+
+def _index(parser, sources):
+    """Returns the tree of commands and options of parser.
+
+    The files of the modules of the commands are added to sources.
+
+    """
+    import argparse
+    from .core import _SubParsersAction, _ModuleFunction
+    node = {'options': {}, 'commands': {}}
+    cmd = parser.get_default('cmd')
+    if cmd is not None:
+        if isinstance(cmd, _ModuleFunction):
+            cmd = cmd.load()
+        _add_source(cmd, sources)
+    for action in parser._actions:
+        if isinstance(action, _SubParsersAction):
+            helps = dict((choice.dest, choice.help)
+                         for choice in action._get_subactions())
+            for name in list(action._name_parser_map):
+                child = _index(action.get_parser(name), sources)
+                child['help'] = helps.get(name) or ''
+                node['commands'][name] = child
+        elif action.option_strings and action.help != argparse.SUPPRESS:
+            if action.choices:
+                value = [str(choice) for choice in action.choices]
+            else:
+                value = action.nargs != 0
+            for option in action.option_strings:
+                node['options'][option] = value
+    return node
+
+
+def _add_source(function, sources):
+    try:
+        path = inspect.getsourcefile(function)
+    except TypeError:
+        path = None
+    if not path:
+        return
+    path = os.path.abspath(path)
+    sources.add(path)
+    # New modules of a package change the directory
+    directory = os.path.dirname(path)
+    if os.path.exists(os.path.join(directory, '__init__.py')):
+        sources.add(directory)
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def _stale(index):
+    for path, stamp in index['sources'].items():
+        if _stamp(path) != stamp:
+            return True
+    return False
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    if not args:
+        sys.stderr.write('Usage: python -m skal.completion INDEX '
+                         '[WORDS...]\n')
+        return 2
+    for candidate in complete(args[0], args[1:]):
+        sys.stdout.write(candidate.encode('utf-8') + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,12 +13,24 @@
 # limitations under the License.
 
 
+import os
 import sys
+import imp
+import ast
+import re
+import json
+import shlex
+import hashlib
+import pkgutil
 import argparse
 import inspect
 import types
+import StringIO
 import traceback
 
+from .decorators import command, default, _registered_commands
+from .timings import timings as _timings
+
 
 class SkalApp(object):
     """A base class for command-subcommand apps
@@ -33,7 +45,23 @@ class SkalApp(object):
                  version=None,
                  args=None,
                  command_modules=[],
-                 subcommand_modules=[]):
+                 subcommand_modules=[],
+                 command_packages=[],
+                 subcommand_packages=[],
+                 lazy=False,
+                 manifest=None,
+                 lazy_parsers=False,
+                 static=False,
+                 chain=None,
+                 stop_on_error=False,
+                 loop=None,
+                 jobs=None,
+                 pool='thread',
+                 profile=False,
+                 help_cache=None,
+                 format=None,
+                 result_cache=None,
+                 result_cache_size=None):
         """Creates the argparser using metadata from decorators
 
         Keyword arguments:
@@ -41,14 +69,55 @@ class SkalApp(object):
         version            -- The version string of the app
         command_modules    -- List, functions from each module will be commands
         subcommand_modules -- List, each module will be a subcommand
+        command_packages   -- List, functions from each package will be
+                              commands and its modules subcommands
+        subcommand_packages -- List, each package will be a subcommand with
+                              its modules as subcommands
+        lazy               -- Only import the modules needed by the command
+                              line given to run (default False)
+        manifest           -- Path to a file caching the commands of modules,
+                              unchanged modules are then not imported until
+                              one of their commands is run
+        lazy_parsers       -- Only build the parser of a command when it is
+                              selected or its help shown (default False)
+        static             -- Find the commands of modules by parsing their
+                              source instead of importing them (default False)
+        chain              -- Argument separating commands run one after the
+                              other by one invocation, like '+' (default None)
+        stop_on_error      -- Don't run the rest of a chain after a failing
+                              command (default False)
+        loop               -- Event loop to run coroutine commands on, by
+                              default one is created when first needed
+        jobs               -- Number of workers running fan-out commands,
+                              also adds the -j/--jobs, --pool and
+                              --as-completed global arguments (default
+                              None, one worker without the arguments)
+        pool               -- Run fan-out commands on 'thread' or forked
+                              'process' workers (default 'thread')
+        profile            -- Add the --profile and --profiler global
+                              arguments, see skal.profiling (default False)
+        help_cache         -- Path to a file caching the rendered help,
+                              shown as is while the files of the app are
+                              unchanged
+        format             -- Format of the items yielded by generator
+                              commands, see skal.output, also adds the
+                              --format global argument (default None,
+                              'lines' without the argument)
+        result_cache       -- Path to a directory caching the results of
+                              commands with the cache option, see
+                              skal.cache, also adds the --no-cache and
+                              --purge-cache global arguments (default None)
+        result_cache_size  -- Bytes the result cache may take before the
+                              least recently used results are removed
+                              (default 32 MB)
 
         """
-        # Description
+        # Description, cleaned when the help is shown
         if description:
-            description = inspect.cleandoc(description)
+            description = _Doc(None, description, None)
         elif (isinstance(self, SkalApp) and
               type(self) != SkalApp):
-            description = inspect.getdoc(self)
+            description = _Doc(None, type(self).__doc__, type(self))
         else:
             sys.stderr.write('Warning: no main documentation\n')
             description = ""
@@ -65,14 +134,61 @@ class SkalApp(object):
             sys.stderr.write('Warning: no version set\n')
 
         # Add the main parser
-        self.__parser = argparse.ArgumentParser(
+        self.__parser = _ArgumentParser(
             description=description,
             formatter_class=argparse.RawDescriptionHelpFormatter)
-        self.__subparser = self.__parser.add_subparsers()
+        self.__subparser = self.__parser.add_subparsers(
+            action=_SubParsersAction, lazy=lazy_parsers)
         if version:
             self.__parser.add_argument('--version', action='version',
                                        version=('%(prog)s v' + version))
 
+        # Add fan-out args
+        if jobs:
+            _add_fanout_arguments(self.__parser, jobs, pool)
+
+        # Add profile args
+        if profile:
+            _add_arguments({
+                '--profile': {
+                    'help': 'write a profile of the command to PATH, a file '
+                            'or a directory',
+                    'dest': '_profile', 'metavar': 'PATH'},
+                '--profiler': {
+                    'help': 'profile with cProfile, writing pstats, or by '
+                            'sampling stacks, writing collapsed stacks',
+                    'choices': ['cprofile', 'sample'], 'default': 'cprofile',
+                    'dest': '_profiler'},
+            }, self.__parser)
+
+        # Add output format args
+        if format:
+            from .output import FORMATS
+            _add_arguments({
+                '--format': {
+                    'help': 'format of the items written by a streaming '
+                            'command',
+                    'choices': FORMATS, 'default': format,
+                    'dest': '_format'},
+            }, self.__parser)
+
+        # Add result cache args
+        self.__result_cache = None
+        if result_cache:
+            from .cache import ResultCache, DEFAULT_SIZE
+            self.__result_cache = ResultCache(
+                result_cache, result_cache_size or DEFAULT_SIZE)
+            _add_arguments({
+                '--no-cache': {
+                    'help': 'run the command without the result cache',
+                    'action': 'store_true', 'default': argparse.SUPPRESS,
+                    'dest': '_no_cache'},
+                '--purge-cache': {
+                    'help': 'remove all cached results and exit',
+                    'action': _PurgeCacheAction,
+                    'cache': self.__result_cache},
+            }, self.__parser)
+
         # Add global args
         if args:
             _add_arguments(args, self.__parser)
@@ -80,30 +196,62 @@ class SkalApp(object):
         # Sub class
         if hasattr(self.__class__, '__args__'):
             _add_arguments(self.__class__.__args__, self.__parser)
-        methods = inspect.getmembers(self.__class__, inspect.ismethod)
-        for name, method in methods:
-            bound_method = types.MethodType(method, self, self.__class__)
-            _add_command(bound_method, self.__subparser)
+        for name in _registered_commands(inspect.getmro(self.__class__)):
+            method = getattr(self.__class__, name, None)
+            if inspect.ismethod(method):
+                bound_method = types.MethodType(method, self, self.__class__)
+                _add_command(bound_method, self.__subparser)
+
+        # Command manifest
+        self.__manifest = _Manifest(manifest) if manifest else None
+        self.__help_cache = None
+        self.__sources = set()
+        if help_cache:
+            # Cached help is only shown for the same main parser
+            inputs = _stable_repr((
+                getattr(description, 'text', description), version, args,
+                list(command_modules), list(subcommand_modules),
+                list(command_packages), list(subcommand_packages), lazy,
+                static, chain, jobs, pool, profile, format,
+                bool(result_cache)))
+            self.__help_cache = _HelpCache(
+                help_cache, hashlib.sha1(inputs).hexdigest())
+            main = getattr(sys.modules.get('__main__'), '__file__', None)
+            for item in (main, type(self), _caller_module()):
+                self.__add_source(item)
+            for name, module in sys.modules.items():
+                if module and name.split('.')[0] == 'skal':
+                    self.__add_source(module)
+        self.__static = static
+        self.__chain = chain
+        self.__stop_on_error = stop_on_error
+        self.__loop = loop
+        self.__jobs = jobs or 1
+        self.__pool = pool
+        self.__format = format or 'lines'
 
         # Modules, as commands
-        for name in command_modules:
-            module = _import_module(name)
-            if module:
-                _add_commands_from_module(
-                    module, self.__parser, self.__subparser)
+        self.__command_modules = list(command_modules)
 
         # Modules, as subcommands
-        for name in subcommand_modules:
-            module = _import_module(name)
-            if module:
-                module_parser, module_subparser = _add_subparser(
-                    module, self.__subparser)
-                _add_commands_from_module(
-                    module, module_parser, module_subparser)
+        self.__subcommand_modules = list(subcommand_modules)
+
+        self.__lazy = lazy
+        if not lazy:
+            self.__load_all()
 
         # Package, as commands
+        for name in command_packages:
+            record = self.__scan(name)
+            if record:
+                self.__add_package(
+                    name, record, self.__parser, self.__subparser)
 
         # Package, as subcommands
+        for name in subcommand_packages:
+            self.__add_node(name, True, self.__subparser)
+
+        self.__save_manifest()
 
     def run(self, args=None):
         """Applicatin starting point.
@@ -114,34 +262,460 @@ class SkalApp(object):
         Keyword arguments:
         args -- Custom application arguments (default sys.argv)
 
+        Returns the return value of the command, or of the last command run
+        in a chain. With SKAL_COMPLETION set in the environment the shell
+        completion is generated instead, see skal.completion, and with
+        SKAL_LINT set the app is checked by lint.
+
         """
         # TODO: Add tests to how command line arguments are passed in
-        raw_args = self.__parser.parse_args(args=args)
+        args = sys.argv[1:] if args is None else args
+        shell = os.environ.get('SKAL_COMPLETION')
+        if shell:
+            from .completion import generate
+            self.preload()
+            return generate(self.__parser, shell)
+        if os.environ.get('SKAL_LINT'):
+            return self.lint()
+        try:
+            if self.__chain and self.__chain in args:
+                return self.__run_chain(args)
+            return self.__dispatch(args)
+        finally:
+            _timings.report()
+
+    def batch(self, source=None, keep_going=False):
+        """Runs many command lines, one per line of a file.
+
+        The lines are read one at a time and split like a shell would. Empty
+        lines and lines starting with # are skipped, as is the program name
+        at the start of a line. A failing line, one raising an exception or
+        exiting with an error, is reported with its line number.
+
+        Keyword arguments:
+        source     -- File object or path to read from (default sys.stdin)
+        keep_going -- Run the rest of the lines after a failure (default
+                      False)
+
+        Returns the exit code, 0 if all lines succeeded and otherwise 1.
+
+        """
+        if source is None:
+            source = sys.stdin
+        elif isinstance(source, basestring):
+            with open(source) as f:
+                return self.batch(f, keep_going)
+        try:
+            return self.__batch(source, keep_going)
+        finally:
+            _timings.report()
+
+    def __batch(self, source, keep_going):
+        prog = shlex.split(self.__parser.prog)
+        failed = []
+        count = 0
+        for lineno, line in enumerate(iter(source.readline, ''), 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            count += 1
+            try:
+                args = shlex.split(line)
+                if args[:len(prog)] == prog:
+                    args = args[len(prog):]
+                code = _exit_code(self.__dispatch(args))
+            except SystemExit as e:
+                code = _exit_code(e.code)
+            except Exception:
+                sys.stderr.write(traceback.format_exc())
+                code = 1
+            if code:
+                sys.stderr.write('Error: line %d failed: %s\n' % (
+                    lineno, line))
+                failed.append(lineno)
+                if not keep_going:
+                    break
+        if failed:
+            sys.stderr.write('Error: %d of %d lines failed: %s\n' % (
+                len(failed), count, ', '.join(str(n) for n in failed)))
+            return 1
+        return 0
+
+    @property
+    def event_loop(self):
+        """The event loop coroutine commands are run on.
+
+        The loop is shared by all commands run by the app, and is the current
+        loop of the thread while a coroutine command runs.
+
+        """
+        if self.__loop is None:
+            self.__loop = _import_asyncio().new_event_loop()
+        return self.__loop
+
+    def serve(self, path, fork=False):
+        """Runs the command lines sent to a unix socket, see skal.server.
+
+        Keyword arguments:
+        path -- Path of the unix socket to listen on
+        fork -- Run each command line in a fork of the app (default False)
+
+        """
+        from .server import serve
+        serve(self, path, fork)
+
+    def preload(self):
+        """Imports all command modules and builds all parsers.
+
+        Used before copies of a lazy app are forked, so that each copy starts
+        with everything loaded.
+
+        """
+        self.__load_all()
+        _preload(self.__parser)
+        self.__save_manifest()
+
+    def lint(self):
+        """Checks that all commands, modules and packages are documented.
+
+        Running commands doesn't look at their documentation, which is only
+        used when a help screen is shown. All command modules are imported
+        and all parsers built, and a warning is written for each command,
+        module and package without documentation.
+
+        Returns the exit code, 1 if there were any warnings.
+
+        """
+        self.preload()
+        return 1 if _lint(self.__parser) else 0
+
+    def __dispatch(self, args):
+        """Parses args and calls the selected command"""
+        if self.__help_cache and _help_words(args) is not None:
+            return self.__help(args)
+        cmd, args = self.__parse(args)
+        if hasattr(cmd, '__call__'):
+            return self.__call(cmd, args)
+
+    def __help(self, args):
+        """Shows the help asked for by args, from the help cache if fresh.
+
+        Otherwise args are parsed as usual, and the help written by the parser
+        is cached along with the stamps of the files of the app loaded so far.
+
+        """
+        words = _help_words(args)
+        text = self.__help_cache.get(words)
+        if text is not None:
+            sys.stdout.write(text)
+            sys.exit(0)
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            cmd, args = self.__parse(args)
+        except SystemExit as e:
+            text = sys.stdout.getvalue()
+            sys.stdout = stdout
+            sys.stdout.write(text)
+            if text and not e.code:
+                self.__help_cache.put(words, text, self.__sources)
+                self.__help_cache.save()
+            raise
+        finally:
+            sys.stdout = stdout
+        if hasattr(cmd, '__call__'):
+            return self.__call(cmd, args)
+
+    def __call(self, cmd, args):
+        """Calls a command, replayed from the result cache if it is cached"""
+        path = args.pop('_profile', None)
+        profiler = args.pop('_profiler', None)
+        if path:
+            from .profiling import run
+            return run(lambda: self.__call(cmd, args),
+                       _command_label(cmd, args), path, profiler)
+        no_cache = args.pop('_no_cache', False)
+        if self.__result_cache and not no_cache:
+            # Read from the record of a pending module, not importing it
+            if isinstance(cmd, _ModuleFunction):
+                ttl = cmd.cache
+            else:
+                ttl = getattr(cmd, '__cache__', None)
+            if ttl:
+                return self.__result_cache.call(
+                    _cache_key(cmd, args), ttl,
+                    lambda: self.__call_uncached(cmd, args))
+        return self.__call_uncached(cmd, args)
+
+    def __call_uncached(self, cmd, args):
+        """Calls a command, once per value of its fan-out argument"""
+        format = args.pop('_format', self.__format)
+        dest = args.pop('_fanout', None)
+        jobs = args.pop('_jobs', self.__jobs)
+        pool = args.pop('_pool', self.__pool)
+        as_completed = args.pop('_as_completed', False)
+        if dest and isinstance(args.get(dest), list):
+            return self.__fan_out(cmd, args, format, dest, jobs, pool,
+                                  as_completed)
+        return self.__call_one(cmd, args, format)
+
+    def __call_one(self, cmd, args, format):
+        """Calls a command, running coroutines on the event loop.
+
+        The items yielded by a generator are written in format as they come,
+        see skal.output.
+
+        """
+        function = _load_command(cmd)
+        with _timings.measure('command', function.__name__):
+            if _is_coroutine_function(function):
+                return _run_coroutine(self.event_loop, function(**args))
+            result = cmd(**args)
+            if isinstance(result, types.GeneratorType):
+                from .output import write
+                return write(result, format)
+            return result
+
+    def __fan_out(self, cmd, args, format, dest, jobs, pool, as_completed):
+        """Calls a command once per value of args[dest] on a pool of workers.
+
+        The output of each call is written when the call is done, in the
+        order of the values unless as_completed. A failing call, one raising
+        an exception or exiting with an error, is reported with its value.
+
+        Returns the exit code, 0 if all calls succeeded and otherwise 1.
+
+        """
+        from .fanout import thread_map, fork_map, in_order
+        values = args[dest]
+
+        def call(value):
+            return self.__call_one(cmd, dict(args, **{dest: value}), format)
+        jobs = max(1, min(jobs, len(values)))
+        if pool == 'process':
+            results = fork_map(call, values, jobs)
+        else:
+            function = _load_command(cmd)
+            if _is_coroutine_function(function):
+                # The event loop can only run in one thread at a time
+                jobs = 1
+            results = thread_map(call, values, jobs)
+        if not as_completed:
+            results = in_order(results)
+        failed = []
+        for index, code, out, err in results:
+            sys.stdout.write(out)
+            sys.stderr.write(err)
+            if code:
+                sys.stderr.write('Error: item %d failed: %s\n' % (
+                    index + 1, values[index]))
+                failed.append(index)
+        if failed:
+            sys.stderr.write('Error: %d of %d items failed: %s\n' % (
+                len(failed), len(values),
+                ', '.join(str(values[i]) for i in sorted(failed))))
+            return 1
+        return 0
+
+    def __parse(self, args, namespace=None):
+        """Returns the selected command and its arguments"""
+        self.__load(args)
+        self.__save_manifest()
+        with _timings.measure('parse', ' '.join(args)):
+            raw_args = _fast_parse(self.__parser, args, argparse.Namespace(
+                **vars(namespace or argparse.Namespace())))
+            if raw_args is None:
+                raw_args = self.__parser.parse_args(
+                    args=args, namespace=namespace)
         args = vars(raw_args)
         cmd = args.pop('cmd')
-        if hasattr(cmd, '__call__'):
-            cmd(**args)
+        return cmd, args
 
+    def __run_chain(self, args):
+        """Runs each command of a chain, sharing the global arguments.
 
-def command(func_or_args=None):
-    """Decorator to tell Skal that the method/function is a command.
+        All commands are parsed before any is run. The global arguments given
+        before a command are passed on to the commands after it, which may
+        also override them.
 
-    """
-    def decorator(f):
-        f.__args__ = args
-        return f
-    if type(func_or_args) == type(decorator):
-        args = {}
-        return decorator(func_or_args)
-    args = func_or_args
-    return decorator
+        """
+        segments = [[]]
+        for arg in args:
+            if arg == self.__chain:
+                segments.append([])
+            else:
+                segments[-1].append(arg)
+        dests = [action.dest for action in self.__parser._actions
+                 if action.default is not argparse.SUPPRESS and
+                 action.dest is not argparse.SUPPRESS]
+        shared = {}
+        commands = []
+        for segment in segments:
+            cmd, cmd_args = self.__parse(
+                segment, argparse.Namespace(**shared))
+            shared = dict((dest, cmd_args[dest]) for dest in dests
+                          if dest in cmd_args)
+            commands.append((cmd, cmd_args))
+        result = None
+        for cmd, cmd_args in commands:
+            try:
+                result = self.__call(cmd, cmd_args)
+            except SystemExit as e:
+                result = e.code
+            if self.__stop_on_error and result not in (None, 0):
+                break
+        return result
 
+    def __load(self, args):
+        """Imports the pending modules needed to parse args.
 
-def default(f):
-    """Decorator to tell Skal that the method/function is the default.
+        The first positional argument that names a known command stops the
+        loading. Command modules are imported in order until one of them
+        provides the name, keeping the precedence of an eager load. If no
+        command is found, as for the main help, all pending modules are loaded.
+        An unknown option first loads all command modules, as it may be a
+        global argument of one of them.
 
-    """
-    raise NotImplementedError
+        """
+        args = iter(args)
+        for arg in args:
+            if arg.startswith('-'):
+                option = arg.split('=', 1)[0]
+                actions = self.__parser._option_string_actions
+                if option not in actions:
+                    while self.__command_modules:
+                        self.__load_command_module(
+                            self.__command_modules.pop(0))
+                action = actions.get(option)
+                if action and action.nargs is None and '=' not in arg:
+                    # The value of the option is not a command
+                    next(args, None)
+                continue
+            if arg in self.__subparser._name_parser_map:
+                return
+            for name in self.__subcommand_modules:
+                if name.rpartition('.')[2] == arg:
+                    self.__subcommand_modules.remove(name)
+                    self.__load_subcommand_module(name)
+                    return
+            while self.__command_modules:
+                self.__load_command_module(self.__command_modules.pop(0))
+                if arg in self.__subparser._name_parser_map:
+                    return
+        self.__load_all()
+
+    def __load_all(self):
+        while self.__command_modules:
+            self.__load_command_module(self.__command_modules.pop(0))
+        while self.__subcommand_modules:
+            self.__load_subcommand_module(self.__subcommand_modules.pop(0))
+
+    def __load_command_module(self, name):
+        record = self.__scan(name)
+        if record:
+            _add_commands_from_record(
+                record, self.__parser, self.__subparser)
+
+    def __load_subcommand_module(self, name):
+        record = self.__scan(name)
+        if record:
+            _add_subparser(record, self.__subparser)
+
+    def __add_node(self, name, ispkg, parent):
+        """Adds a package or a module of a package as a subcommand.
+
+        The node is scanned when its parser is built, which for a lazy app
+        means when it is selected. The help is then taken from the manifest,
+        if there is one.
+
+        """
+        lazy = self.__lazy or parent.lazy
+        if not lazy:
+            record = self.__scan(name)
+            if not record:
+                return
+        elif self.__manifest:
+            record = self.__manifest.get(name)
+        else:
+            record = None
+        mod = name.rpartition('.')[2]
+        if record:
+            self.__add_source(record['path'])
+            doc = _Doc(mod, record['doc'], record['path'])
+        else:
+            doc = _Doc(mod, None, None)
+
+        def build(parser):
+            subparser = parser.add_subparsers(
+                action=_SubParsersAction, lazy=parent.lazy)
+            node = record or self.__scan(name)
+            if node:
+                if not record:
+                    doc.text = node['doc']
+                    doc.source = node['path']
+                self.__add_package(name, node, parser, subparser, ispkg)
+        parent.add_parser(
+            mod,
+            build,
+            lazy=lazy,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description=doc,
+            help=doc)
+
+    def __add_package(self, name, record, parser, subparser, ispkg=True):
+        _add_commands_from_record(record, parser, subparser)
+        if ispkg:
+            # New modules of a package change the directory
+            if record['path']:
+                self.__add_source(os.path.dirname(record['path']))
+            for child, child_ispkg in _find_submodules(name):
+                self.__add_node(name + '.' + child, child_ispkg, subparser)
+
+    def __scan(self, name):
+        """Returns the command record of a module.
+
+        A fresh record from the manifest is used as is, otherwise the module
+        is parsed, when static, or imported and scanned, and the manifest
+        updated.
+
+        """
+        if self.__manifest:
+            record = self.__manifest.get(name)
+            if record:
+                self.__add_source(record['path'])
+                return record
+        record = None
+        if self.__static:
+            with _timings.measure('scan', name):
+                record = _parse_module(name)
+        if not record:
+            module = _import_module(name)
+            if not module:
+                return None
+            with _timings.measure('scan', name):
+                record = _scan_module(module)
+        if self.__manifest:
+            self.__manifest.put(name, record)
+        self.__add_source(record['path'])
+        return record
+
+    def __add_source(self, item):
+        """Adds the file of item, a path, module or class, to the sources"""
+        if not self.__help_cache or item in (None, SkalApp):
+            return
+        if isinstance(item, basestring):
+            item = _source_file(item)
+        else:
+            try:
+                item = inspect.getsourcefile(item)
+            except TypeError:
+                return
+        if item:
+            self.__sources.add(os.path.abspath(item))
+
+    def __save_manifest(self):
+        if self.__manifest and self.__manifest.dirty:
+            self.__manifest.save()
 
 
 def _add_arguments(args, parser):
@@ -155,41 +729,487 @@ def _add_arguments(args, parser):
                 arg.append(short)
             if type(full) == str:
                 arg.append(full)
-        options = args[k]
+        options = dict(args[k])
+        fanout = options.pop('fanout', False)
         try:
-            parser.add_argument(*arg, **options)
+            action = parser.add_argument(*arg, **options)
         except argparse.ArgumentError as e:
             sys.stderr.write('Warning: argument error: %s\n' % e)
+            continue
+        if fanout:
+            parser.set_defaults(_fanout=action.dest)
+            _add_fanout_arguments(parser)
+
+
+def _add_fanout_arguments(parser, jobs=argparse.SUPPRESS,
+                          pool=argparse.SUPPRESS):
+    # Given after a fan-out command the arguments override the global ones
+    if '--jobs' in parser._option_string_actions:
+        return
+    _add_arguments({
+        ('-j', '--jobs'): {
+            'help': 'number of workers running a fan-out command',
+            'type': int, 'default': jobs, 'dest': '_jobs', 'metavar': 'N'},
+        '--pool': {
+            'help': 'run a fan-out command on threads or forked processes',
+            'choices': ['thread', 'process'], 'default': pool,
+            'dest': '_pool'},
+        '--as-completed': {
+            'help': 'write the output of a fan-out command as each call is '
+                    'done instead of in order',
+            'action': 'store_true', 'default': argparse.SUPPRESS,
+            'dest': '_as_completed'},
+    }, parser)
+
+
+class _PurgeCacheAction(argparse.Action):
+    """Removes all results of a result cache and exits"""
+    def __init__(self, option_strings, cache, dest=argparse.SUPPRESS,
+                 default=argparse.SUPPRESS, help=None):
+        super(_PurgeCacheAction, self).__init__(
+            option_strings=option_strings, dest=dest, default=default,
+            nargs=0, help=help)
+        self.cache = cache
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        self.cache.purge()
+        parser.exit()
 
 
 def _add_command(function, parent):
     if hasattr(function, '__args__'):
-        help, desc = _extract_doc(function)
-        if function.__name__ in parent._name_parser_map:
-            sys.stderr.write(
-                'Warning: ignoring duplicate command "%s" in %s\n' % (
-                function.__name__, inspect.getfile(function)))
-            return
-        parser = parent.add_parser(
-            function.__name__,
-            formatter_class=argparse.RawDescriptionHelpFormatter,
-            description=desc,
-            help=help)
-        _add_arguments(function.__args__, parser)
-        parser.set_defaults(cmd=function)
+        _add_command_parser(_Command(function.__name__, function,
+                                     function.__args__, function.__doc__,
+                                     function), parent)
+
+
+def _add_command_parser(command, parent):
+    if command.name in parent._name_parser_map:
+        sys.stderr.write(
+            'Warning: ignoring duplicate command "%s" in %s\n' % (
+            command.name, command.path))
+        return
+    parent.add_command(command)
+
+
+class _Doc(object):
+    """The documentation of a command or module, cleaned when it is shown.
+
+    The source is the path of the file of the documentation, or the command
+    it belongs to, whose file is only looked up when needed.
+
+    """
+    __slots__ = ('name', 'text', 'source')
+
+    def __init__(self, name, text, source):
+        self.name = name
+        self.text = text
+        self.source = source
 
+    @property
+    def desc(self):
+        if not self.text:
+            return ''
+        with _timings.measure('doc', self.name):
+            return inspect.cleandoc(self.text)
 
-def _add_subparser(module, parent):
-    help, desc = _extract_doc(module)
-    package, _, mod = module.__name__.rpartition('.')
-    name = mod if package else mod
-    parser = parent.add_parser(
+    @property
+    def help(self):
+        return self.desc.partition('\n')[0]
+
+    @property
+    def path(self):
+        source = self.source
+        if source is None or isinstance(source, basestring):
+            return _source_file(source)
+        try:
+            return inspect.getsourcefile(source)
+        except TypeError:
+            # We need to get to the original function if the command is
+            # manually bound from a sub class of SkalApp
+            return inspect.getsourcefile(source.__func__)
+
+
+class _Command(_Doc):
+    """The metadata of a command, all needed to build its parser.
+
+    Lazy sub parsers keep these, instead of a parser, until the command is
+    selected. The help is the first line of the documentation.
+
+    """
+    __slots__ = ('cmd', 'args')
+
+    def __init__(self, name, cmd, args, text, source):
+        _Doc.__init__(self, name, text, source)
+        self.cmd = cmd
+        self.args = args
+
+    def build(self, parser):
+        _add_arguments(self.args, parser)
+        parser.set_defaults(cmd=self.cmd)
+
+
+def _add_subparser(record, parent):
+    name = record['name'].rpartition('.')[2]
+    doc = _Doc(name, record['doc'], record['path'])
+
+    def build(parser):
+        subparser = parser.add_subparsers(
+            action=_SubParsersAction, lazy=parent.lazy)
+        _add_commands_from_record(record, parser, subparser)
+    parent.add_parser(
         name,
+        build,
         formatter_class=argparse.RawDescriptionHelpFormatter,
-        description=desc,
-        help=help)
-    subparser = parser.add_subparsers()
-    return parser, subparser
+        description=doc,
+        help=doc)
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    """Argument parser accepting unique prefixes of sub parser names.
+
+    A name that is neither a sub parser nor a unique prefix of one is an
+    error suggesting the names it is a prefix of, or else the names close
+    to it. The description may be a _Doc, cleaned when the help is shown.
+
+    """
+    def format_help(self):
+        if isinstance(self.description, _Doc):
+            self.description = self.description.desc
+        return super(_ArgumentParser, self).format_help()
+
+    def _check_value(self, action, value):
+        if not isinstance(action, _SubParsersAction):
+            return super(_ArgumentParser, self)._check_value(action, value)
+        if action.resolve(value) is not None:
+            return
+        names = action.complete(value)
+        if names:
+            more = ', ...' if len(names) > 10 else ''
+            raise argparse.ArgumentError(
+                action, 'ambiguous choice: %r could match %s%s' % (
+                    value, ', '.join(names[:10]), more))
+        names = action.suggest(value)
+        if names:
+            raise argparse.ArgumentError(
+                action, 'invalid choice: %r (did you mean %s?)' % (
+                    value, ' or '.join(map(repr, names))))
+        super(_ArgumentParser, self)._check_value(action, value)
+
+
+class _SubParsersAction(argparse._SubParsersAction):
+    """Sub parsers that can be built when they are first selected.
+
+    A parser added with a build function is created and passed to it right
+    away, or when lazy, only when it is selected on the command line. The
+    help listing of a lazy parser doesn't need it to be built. A lazy command
+    is kept as its _Command until then, also standing in for its entry in the
+    help listing. A help given as a _Doc, as for all commands and modules, is
+    only cleaned when the listing is shown.
+
+    Names are looked up in a trie, built when a name is first not found, to
+    resolve unique prefixes and suggest names.
+
+    """
+    def __init__(self, *args, **kwargs):
+        self.lazy = kwargs.pop('lazy', False)
+        super(_SubParsersAction, self).__init__(*args, **kwargs)
+        self._trie = None
+
+    def add_parser(self, name, build=None, lazy=None, **kwargs):
+        if lazy is None:
+            lazy = self.lazy
+        if self._trie is not None:
+            self._trie.add(name)
+        if 'help' in kwargs:
+            help = kwargs.pop('help')
+            if not isinstance(help, _Doc):
+                help = self._ChoicesPseudoAction(name, help)
+            self._choices_actions.append(help)
+        if build and lazy:
+            self._name_parser_map[name] = (build, kwargs)
+            return None
+        with _timings.measure('parser', name):
+            parser = super(_SubParsersAction, self).add_parser(
+                name, **kwargs)
+            if build:
+                build(parser)
+        return parser
+
+    def add_command(self, command):
+        """Adds the parser of a command, built from it when needed"""
+        if self.lazy:
+            if self._trie is not None:
+                self._trie.add(command.name)
+            self._choices_actions.append(command)
+            self._name_parser_map[command.name] = command
+            return None
+        return self.add_parser(
+            command.name,
+            command.build,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description=command,
+            help=command)
+
+    def get_parser(self, name):
+        """Returns the parser of name, building it if needed"""
+        parser = self._name_parser_map[name]
+        if isinstance(parser, _Command):
+            command = parser
+            with _timings.measure('parser', name):
+                parser = super(_SubParsersAction, self).add_parser(
+                    name,
+                    formatter_class=argparse.RawDescriptionHelpFormatter,
+                    description=command)
+                command.build(parser)
+        elif type(parser) == tuple:
+            build, kwargs = parser
+            with _timings.measure('parser', name):
+                parser = super(_SubParsersAction, self).add_parser(
+                    name, **kwargs)
+                build(parser)
+        return parser
+
+    def resolve(self, name):
+        """Returns the sub parser name, or the one name is a prefix of.
+
+        None is returned if there is no such name.
+
+        """
+        if name in self._name_parser_map:
+            return name
+        return self.__get_trie().resolve(name)
+
+    def complete(self, prefix):
+        """Returns the sorted names starting with prefix"""
+        return self.__get_trie().complete(prefix)
+
+    def suggest(self, name):
+        """Returns the names closest to name, if close enough"""
+        return self.__get_trie().suggest(name, 1 + len(name) // 4)
+
+    def __get_trie(self):
+        if self._trie is None:
+            self._trie = _Trie(self._name_parser_map)
+        return self._trie
+
+    def _get_subactions(self):
+        return [self._ChoicesPseudoAction(action.name, action.help)
+                if isinstance(action, _Doc) else action
+                for action in self._choices_actions]
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        name = self.resolve(values[0])
+        if name is not None:
+            values = [name] + values[1:]
+            self.get_parser(name)
+        super(_SubParsersAction, self).__call__(
+            parser, namespace, values, option_string)
+
+
+class _Trie(object):
+    """A trie of names, nested dicts of characters ending with a '' key.
+
+    The '' key of a node holds the name ending there.
+
+    """
+    def __init__(self, names=()):
+        self.root = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        node = self.root
+        for char in name:
+            node = node.setdefault(char, {})
+        node[''] = name
+
+    def resolve(self, prefix):
+        """Returns the only name starting with prefix, or None if empty"""
+        if not prefix:
+            return None
+        node = self.__find(prefix)
+        while node and len(node) == 1 and '' not in node:
+            node = node.values()[0]
+        if node and len(node) == 1:
+            return node['']
+        return None
+
+    def complete(self, prefix):
+        """Returns the sorted names starting with prefix"""
+        names = []
+        nodes = [self.__find(prefix) or {}]
+        while nodes:
+            node = nodes.pop()
+            for char, child in node.items():
+                if char:
+                    nodes.append(child)
+                else:
+                    names.append(child)
+        return sorted(names)
+
+    def suggest(self, word, distance, limit=3):
+        """Returns the names at most distance edits from word.
+
+        The closest names come first, at most limit of them.
+
+        """
+        found = []
+        row = range(len(word) + 1)
+        for char, child in self.root.items():
+            if char:
+                self.__search(child, char, word, row, distance, found)
+        return [name for _, name in sorted(found)[:limit]]
+
+    def __find(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def __search(self, node, char, word, previous, distance, found):
+        # One row of the edit distance table per character of the trie
+        row = [previous[0] + 1]
+        for i, other in enumerate(word):
+            row.append(min(row[i] + 1, previous[i + 1] + 1,
+                           previous[i] + (other != char)))
+        if row[-1] <= distance and '' in node:
+            found.append((row[-1], node['']))
+        if min(row) <= distance:
+            for char, child in node.items():
+                if char:
+                    self.__search(child, char, word, row, distance, found)
+
+
+_FAST_ACTIONS = (argparse._StoreAction, argparse._StoreConstAction,
+                 argparse._StoreTrueAction, argparse._StoreFalseAction)
+
+
+def _fast_parse(parser, args, namespace=None):
+    """Parses args like parser.parse_args in a single pass.
+
+    Only options that store a value or a constant, given as separate words or
+    as --option=value, and sub parsers are understood. None is returned for
+    anything else, like help, abbreviations and errors, for argparse to handle
+    with the same namespace.
+
+    """
+    table = _fast_table(parser)
+    if table is None:
+        return None
+    options, subparsers = table
+    if namespace is None:
+        namespace = argparse.Namespace()
+    for action in parser._actions:
+        if (action.dest is not argparse.SUPPRESS and
+                not hasattr(namespace, action.dest) and
+                action.default is not argparse.SUPPRESS):
+            setattr(namespace, action.dest, action.default)
+    for dest in parser._defaults:
+        if not hasattr(namespace, dest):
+            setattr(namespace, dest, parser._defaults[dest])
+    seen = set()
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith('-'):
+            option, explicit, value = arg.partition('=')
+            action = options.get(option)
+            if action is None:
+                return None
+            if action.nargs == 0:
+                if explicit:
+                    return None
+                value = action.const
+            else:
+                if not explicit:
+                    i += 1
+                    if i == len(args) or args[i].startswith('-'):
+                        return None
+                    value = args[i]
+                value = _fast_value(action, value)
+                if value is _fast_parse:
+                    return None
+            setattr(namespace, action.dest, value)
+            seen.add(action)
+        else:
+            name = subparsers.resolve(arg) if subparsers else None
+            if name is None:
+                return None
+            if subparsers.dest is not argparse.SUPPRESS:
+                setattr(namespace, subparsers.dest, name)
+            subnamespace = _fast_parse(subparsers.get_parser(name),
+                                       args[i + 1:])
+            if subnamespace is None:
+                return None
+            for key, value in vars(subnamespace).items():
+                setattr(namespace, key, value)
+            seen.add(subparsers)
+            break
+        i += 1
+    if subparsers and subparsers not in seen:
+        return None
+    for action in parser._actions:
+        if (action not in seen and
+                isinstance(action.default, basestring) and
+                hasattr(namespace, action.dest) and
+                action.default is getattr(namespace, action.dest)):
+            value = _fast_value(action, action.default)
+            if value is _fast_parse:
+                return None
+            setattr(namespace, action.dest, value)
+    return namespace
+
+
+def _fast_table(parser):
+    """Returns the (options, sub parsers) of parser used by _fast_parse.
+
+    The options map each option string to its action. None is returned for
+    parsers using features that are left to argparse, and the result is kept
+    on the parser.
+
+    """
+    try:
+        return parser._fast_table
+    except AttributeError:
+        pass
+    options = {}
+    subparsers = None
+    table = (options, subparsers)
+    if (parser.prefix_chars != '-' or parser.fromfile_prefix_chars or
+            parser._mutually_exclusive_groups):
+        table = None
+    for action in parser._actions:
+        if action.required and action.option_strings:
+            table = None
+        elif action.option_strings:
+            # Other options, like help, make argparse parse the arguments
+            if type(action) in _FAST_ACTIONS and action.nargs in (None, 0):
+                for option in action.option_strings:
+                    options[option] = action
+        elif isinstance(action, _SubParsersAction) and not subparsers:
+            subparsers = action
+            table = table and (options, subparsers)
+        else:
+            table = None
+    parser._fast_table = table
+    return table
+
+
+def _fast_value(action, value):
+    """Returns value converted and checked like argparse, or _fast_parse"""
+    if action.type is not None:
+        if not callable(action.type):
+            return _fast_parse
+        try:
+            value = action.type(value)
+        except Exception:
+            return _fast_parse
+    if action.choices is not None and value not in action.choices:
+        return _fast_parse
+    return value
 
 
 def _import_module(name):
@@ -197,7 +1217,9 @@ def _import_module(name):
     package, _, mod = name.partition('.')
     fromlist = [mod] if mod else []
     try:
-        module = __import__(name, fromlist=fromlist)
+        with _timings.measure('import', name):
+            with _timings.trace_imports(name):
+                module = __import__(name, fromlist=fromlist)
     except ImportError as e:
         if str(e).split(' ')[3] == name:
             sys.stderr.write(
@@ -218,26 +1240,498 @@ def _import_module(name):
 
 
 def _add_commands_from_module(module, parser, subparser):
-    if hasattr(module, '__args__'):
-        _add_arguments(module.__args__, parser)
-    functions = inspect.getmembers(module, inspect.isfunction)
-    for name, function in functions:
-        _add_command(function, subparser)
+    _add_commands_from_record(_scan_module(module), parser, subparser)
 
 
-def _extract_doc(item):
-    desc = inspect.getdoc(item)
-    if not desc:
-        try:
-            sourcefile = inspect.getsourcefile(item)
-        except TypeError:
-            # We need to get to the original function if item is manually bound
-            # from a sub class of SkalApp
-            sourcefile = inspect.getsourcefile(item.__func__)
-        sys.stderr.write('Warning: no documentation for "%s" in %s\n' % (
-            item.__name__, sourcefile))
-        desc = ''
-        help = ''
+def _add_commands_from_record(record, parser, subparser):
+    if record['args']:
+        _add_arguments(record['args'], parser)
+    module = record.get('module')
+    for name, doc, args, cache in record['commands']:
+        if module:
+            cmd = getattr(module, name)
+        else:
+            cmd = _ModuleFunction(record['name'], name, cache)
+        _add_command_parser(_Command(name, cmd, args, doc, record['path']),
+                            subparser)
+
+
+def _scan_module(module):
+    """Returns the command record of an imported module.
+
+    The record holds everything needed to build the parsers of the module:
+    its name, source file, docstring, global arguments and a list of
+    (name, docstring, arguments, cache option) for each command.
+
+    """
+    commands = []
+    for name in _registered_commands([module]):
+        function = getattr(module, name, None)
+        if inspect.isfunction(function) and hasattr(function, '__args__'):
+            commands.append((name, function.__doc__, function.__args__,
+                             getattr(function, '__cache__', None)))
+    return {
+        'name': module.__name__,
+        # The source file is only looked up when needed, see _source_file
+        'path': getattr(module, '__file__', None),
+        'doc': module.__doc__,
+        'args': getattr(module, '__args__', None),
+        'commands': commands,
+        'module': module,
+    }
+
+
+# The modules the command decorator can be imported from
+_COMMAND_MODULES = ('skal', 'skal.core', 'skal.decorators')
+
+
+def _parse_module(name):
+    """Returns the command record of a module by parsing its source.
+
+    Only top level functions decorated with the command decorator of skal,
+    using literal arguments, are found. None is returned if the module can't
+    be understood without importing it.
+
+    """
+    path = _find_module_file(name)
+    if not path or not path.endswith('.py'):
+        return None
+    try:
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+    except (IOError, SyntaxError, TypeError):
+        return None
+    names = set()
+    modules = set()
+    args = None
+    commands = {}
+    try:
+        for node in tree.body:
+            if isinstance(node, ast.ImportFrom):
+                if node.module in _COMMAND_MODULES and not node.level:
+                    for alias in node.names:
+                        if alias.name in ('command', '*'):
+                            names.add(alias.asname or 'command')
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.name == 'skal' or (
+                            alias.name in _COMMAND_MODULES and alias.asname):
+                        modules.add(alias.asname or alias.name)
+            elif isinstance(node, ast.Assign):
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        commands.pop(target.id, None)
+                        if target.id == '__args__':
+                            args = ast.literal_eval(node.value)
+            elif isinstance(node, ast.FunctionDef):
+                commands.pop(node.name, None)
+                command = _parse_command(node, names, modules)
+                if command:
+                    commands[node.name] = command
+    except ValueError:
+        # Arguments that are not literals need the module to be imported
+        return None
+    return {
+        'name': name,
+        'path': path,
+        'doc': ast.get_docstring(tree),
+        'args': args,
+        'commands': [commands[n] for n in sorted(commands)],
+    }
+
+
+def _parse_command(node, names, modules):
+    """Returns (name, docstring, arguments, cache) of a decorated function.
+
+    Raises ValueError if the function is a command that can't be understood
+    without importing its module.
+
+    """
+    args = None
+    cache = None
+    others = False
+    for decorator in node.decorator_list:
+        call = decorator if isinstance(decorator, ast.Call) else None
+        target = call.func if call else decorator
+        if ((isinstance(target, ast.Name) and target.id in names) or
+                (isinstance(target, ast.Attribute) and
+                 target.attr == 'command' and
+                 isinstance(target.value, ast.Name) and
+                 target.value.id in modules)):
+            if call and (len(call.args) > 1 or call.starargs or
+                         call.kwargs or [keyword for keyword in call.keywords
+                                         if keyword.arg != 'cache']):
+                raise ValueError('unsupported command arguments')
+            args = ast.literal_eval(call.args[0]) if call and call.args else {}
+            for keyword in call.keywords if call else []:
+                cache = ast.literal_eval(keyword.value)
+        elif ((isinstance(target, ast.Name) and target.id == 'command') or
+              (isinstance(target, ast.Attribute) and
+               target.attr == 'command')):
+            # Likely the decorator of skal, imported in a way not understood
+            raise ValueError('unknown command decorator')
+        else:
+            others = True
+    if args is None:
+        return None
+    if others:
+        raise ValueError('unknown decorator on command')
+    return (node.name, ast.get_docstring(node), args, cache)
+
+
+def _exit_code(value):
+    """Returns the exit code sys.exit would give for value"""
+    if value is None:
+        return 0
+    if isinstance(value, (int, long)):
+        # Like the exit status of a process, True is 1
+        return int(value) & 0xff
+    sys.stderr.write('%s\n' % value)
+    return 1
+
+
+def _cache_key(cmd, args):
+    """Returns the result cache key of a command and its arguments.
+
+    Methods are named by their class too, as apps of one module may have
+    commands of the same name. The workers of a fan-out command don't change
+    its results and are left out.
+
+    """
+    from .cache import key
+    if isinstance(cmd, _ModuleFunction):
+        names = [cmd.module, cmd.name]
     else:
-        help, _, _ = desc.partition('\n')
-    return help, desc
+        names = [cmd.__module__, cmd.__name__]
+        owner = getattr(cmd, '__self__', None)
+        if owner is not None:
+            names.insert(1, type(owner).__name__)
+    args = dict((name, value) for name, value in args.items()
+                if name not in ('_jobs', '_pool'))
+    return key('.'.join(names), args)
+
+
+def _command_label(cmd, args):
+    """Returns the name of a command and its arguments as name=value"""
+    function = _load_command(cmd)
+    return ' '.join([function.__name__] + [
+        '%s=%s' % (key, value) for key, value in sorted(args.items())
+        if value is not None and not key.startswith('_')])
+
+
+def _call_exit_code(function, *args):
+    """Calls function, returns the exit code sys.exit would give"""
+    try:
+        return _exit_code(function(*args))
+    except SystemExit as e:
+        return _exit_code(e.code)
+    except KeyboardInterrupt:
+        return 130
+    except Exception:
+        sys.stderr.write(traceback.format_exc())
+        return 1
+
+
+def _import_asyncio():
+    try:
+        import asyncio
+    except ImportError:
+        import trollius as asyncio
+    return asyncio
+
+
+def _is_coroutine_function(function):
+    # Checked without importing asyncio, which is only needed when there are
+    # coroutines. The decorator of asyncio and trollius marks the functions.
+    if getattr(function, '_is_coroutine', False):
+        return True
+    iscoroutinefunction = getattr(inspect, 'iscoroutinefunction', None)
+    return bool(iscoroutinefunction and iscoroutinefunction(function))
+
+
+def _run_coroutine(loop, coroutine):
+    """Runs a coroutine on loop, cancelling it if interrupted"""
+    asyncio = _import_asyncio()
+    asyncio.set_event_loop(loop)
+    ensure_future = getattr(asyncio, 'ensure_future', None)
+    task = (ensure_future or getattr(asyncio, 'async'))(coroutine, loop=loop)
+    try:
+        return loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        if not task.done():
+            task.cancel()
+            try:
+                loop.run_until_complete(task)
+            except BaseException:
+                pass
+        raise
+
+
+def _preload(parser):
+    cmd = parser.get_default('cmd')
+    if isinstance(cmd, _ModuleFunction):
+        cmd.load()
+    for action in parser._actions:
+        if isinstance(action, _SubParsersAction):
+            for name in list(action._name_parser_map):
+                _preload(action.get_parser(name))
+
+
+def _lint(parser):
+    """Warns of each command and module below parser without documentation.
+
+    Returns the number of warnings.
+
+    """
+    count = 0
+    for action in parser._actions:
+        if isinstance(action, _SubParsersAction):
+            for doc in list(action._choices_actions):
+                if not isinstance(doc, _Doc):
+                    continue
+                child = action.get_parser(doc.name)
+                if not doc.text:
+                    sys.stderr.write(
+                        'Warning: no documentation for "%s" in %s\n' % (
+                        doc.name, doc.path))
+                    count += 1
+                count += _lint(child)
+    return count
+
+
+def _find_submodules(name):
+    """Returns (name, ispkg) of the modules in a package without importing"""
+    path = _find_module_file(name)
+    if not path or os.path.basename(path) != '__init__.py':
+        return []
+    return [(mod, ispkg) for _, mod, ispkg in
+            pkgutil.iter_modules([os.path.dirname(path)])]
+
+
+def _source_file(path):
+    """Returns the source file of the file of a module, like a .pyc"""
+    if path and os.path.splitext(path)[1] in ('.pyc', '.pyo'):
+        return path[:-1]
+    return path
+
+
+def _find_module_file(name):
+    """Returns the file of a module without importing it, or None"""
+    path = None
+    pathname = None
+    for part in name.split('.'):
+        try:
+            f, pathname, description = imp.find_module(part, path)
+        except ImportError:
+            return None
+        if f:
+            f.close()
+        if description[2] == imp.PKG_DIRECTORY:
+            path = [pathname]
+            pathname = os.path.join(pathname, '__init__.py')
+    return pathname
+
+
+class _ModuleFunction(object):
+    """A command function that is imported when it is called"""
+    __slots__ = ('module', 'name', 'cache', 'function')
+
+    def __init__(self, module, name, cache=None):
+        self.module = module
+        self.name = name
+        self.cache = cache
+        self.function = None
+
+    def load(self):
+        if self.function is None:
+            module = _import_module(self.module)
+            self.function = getattr(module, self.name, None)
+        return self.function
+
+    def __call__(self, **args):
+        return _load_command(self)(**args)
+
+
+def _load_command(cmd):
+    """Returns the function of a command, exits if it can't be imported"""
+    if not isinstance(cmd, _ModuleFunction):
+        return cmd
+    function = cmd.load()
+    if function is None:
+        sys.stderr.write('Error: command "%s" not found in "%s"\n' % (
+            cmd.name, cmd.module))
+        sys.exit(1)
+    return function
+
+
+class _Manifest(object):
+    """Command records of modules, cached on disk between runs.
+
+    Each record is stored under its module name together with the source file
+    and its modification time and size. A record is only used while the module
+    is found in the same, unchanged file.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.dirty = False
+        try:
+            with open(path) as f:
+                self.records = _from_json(json.load(f))
+        except (IOError, ValueError):
+            self.records = {}
+
+    def get(self, name):
+        record = self.records.get(name)
+        if not record:
+            return None
+        path = _find_module_file(name)
+        if path != record['path'] or _file_stamp(path) != record['stamp']:
+            return None
+        if [c for c in record['commands'] if len(c) != 4]:
+            # Written before the cache option was recorded
+            return None
+        return {
+            'name': name,
+            'path': path,
+            'doc': record['doc'],
+            'args': _decode_args(record['args']),
+            'commands': [(n, doc, _decode_args(args), cache)
+                         for n, doc, args, cache in record['commands']],
+        }
+
+    def put(self, name, record):
+        path = _find_module_file(name)
+        stored = None
+        if path and path == _source_file(record['path']):
+            stored = {
+                'path': path,
+                'stamp': _file_stamp(path),
+                'doc': record['doc'],
+                'args': _encode_args(record['args']),
+                'commands': [(n, doc, _encode_args(args), cache)
+                             for n, doc, args, cache in record['commands']],
+            }
+            try:
+                json.dumps(stored)
+            except (TypeError, ValueError):
+                # Arguments using callables etc can't be cached
+                stored = None
+        if stored:
+            self.records[name] = stored
+        elif name in self.records:
+            del self.records[name]
+        self.dirty = True
+
+    def save(self):
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.records, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            sys.stderr.write('Warning: could not write manifest: %s\n' % e)
+        self.dirty = False
+
+
+class _HelpCache(object):
+    """Help screens rendered by the parsers, cached on disk between runs.
+
+    Each help screen is stored under the arguments before the help option,
+    together with the modification times and sizes of the files of the app it
+    was rendered from, the terminal width and the inputs, a hash of the
+    options of the app. A help screen is only used while those are unchanged.
+
+    """
+    def __init__(self, path, inputs):
+        self.path = path
+        self.inputs = inputs
+        try:
+            with open(path) as f:
+                self.entries = _from_json(json.load(f))
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get(self, words):
+        entry = self.entries.get(json.dumps(words))
+        if (not entry or entry['columns'] != os.environ.get('COLUMNS') or
+                entry.get('inputs') != self.inputs):
+            return None
+        for path, stamp in entry['sources'].items():
+            if _file_stamp(path) != stamp:
+                return None
+        return entry['text']
+
+    def put(self, words, text, sources):
+        self.entries[json.dumps(words)] = {
+            'text': text,
+            'columns': os.environ.get('COLUMNS'),
+            'inputs': self.inputs,
+            'sources': dict((path, _file_stamp(path)) for path in sources),
+        }
+
+    def save(self):
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            sys.stderr.write('Warning: could not write help cache: %s\n' % e)
+
+
+def _stable_repr(value):
+    """Returns repr of value without the addresses of objects"""
+    return re.sub(r' at 0x[0-9a-fA-F]+', '', repr(value))
+
+
+def _caller_module():
+    """Returns the module of the innermost frame outside of Skal"""
+    frame = sys._getframe(1)
+    while frame:
+        name = frame.f_globals.get('__name__', '')
+        if name.split('.')[0] != 'skal':
+            return sys.modules.get(name)
+        frame = frame.f_back
+    return None
+
+
+def _help_words(args):
+    """Returns the arguments before a help option, or None if there is none"""
+    for i, arg in enumerate(args):
+        if arg == '--':
+            break
+        if arg in ('-h', '--help'):
+            return args[:i]
+    return None
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def _encode_args(args):
+    if args is None:
+        return None
+    return [(list(k) if type(k) == tuple else [k], v)
+            for k, v in args.items()]
+
+
+def _decode_args(args):
+    if args is None:
+        return None
+    return dict((tuple(k) if len(k) > 1 else k[0], v) for k, v in args)
+
+
+def _from_json(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+    if isinstance(value, dict):
+        return dict((_from_json(k), _from_json(v)) for k, v in value.items())
+    return value
@@ -0,0 +1,87 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""The decorators of commands, cheap to import for command modules.
+
+Tagging a function only needs this module, the rest of Skal is imported when
+a SkalApp is created.
+
+"""
+
+
+import sys
+
+
+# The flag of the code of functions, see inspect.CO_OPTIMIZED
+_CO_OPTIMIZED = 0x1
+
+
+def command(func_or_args=None, cache=None):
+    """Decorator to tell Skal that the method/function is a command.
+
+    The name of the command is registered in the namespace it is defined in,
+    the module or the class body, where SkalApp looks it up.
+
+    Keyword arguments:
+    cache -- Seconds the results of the command are kept in the result cache
+             of the app, True for no limit, see skal.cache (default None)
+
+    """
+    def decorator(f, namespace=None):
+        f.__args__ = args
+        f.__cache__ = cache
+        if namespace is None:
+            namespace = _namespace(sys._getframe(1), f)
+        names = namespace.setdefault('__skal_commands__', [])
+        if f.__name__ not in names:
+            names.append(f.__name__)
+        return f
+    if type(func_or_args) == type(decorator):
+        args = {}
+        return decorator(func_or_args,
+                         _namespace(sys._getframe(1), func_or_args))
+    args = {} if func_or_args is None else func_or_args
+    return decorator
+
+
+def _namespace(frame, function):
+    """Returns the namespace of the module or class body frame is run in.
+
+    Functions wrapping command, like helpers and factories, are skipped. A
+    function decorated from another module is registered in its own.
+
+    """
+    while frame.f_code.co_flags & _CO_OPTIMIZED and frame.f_back:
+        frame = frame.f_back
+    if (frame.f_locals is frame.f_globals and
+            frame.f_globals.get('__name__') != function.__module__ and
+            function.__module__ in sys.modules):
+        return vars(sys.modules[function.__module__])
+    return frame.f_locals
+
+
+def _registered_commands(namespaces):
+    """Returns the sorted names registered by command in the namespaces"""
+    names = set()
+    for namespace in namespaces:
+        names.update(vars(namespace).get('__skal_commands__', ()))
+    return sorted(names)
+
+
+def default(f):
+    """Decorator to tell Skal that the method/function is the default.
+
+    """
+    raise NotImplementedError
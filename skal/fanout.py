@@ -0,0 +1,193 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Worker pools running the calls of fan-out commands.
+
+A fan-out command is called once per value of its fan-out argument, by
+thread_map on threads or by fork_map on forked processes, jobs at a time.
+Both yield the exit code, output and errors of each call as it is done, and
+in_order puts them back in the order of the values.
+
+"""
+
+
+import os
+import sys
+import time
+import Queue
+import signal
+import StringIO
+import tempfile
+import threading
+
+from .core import _call_exit_code
+
+
+def thread_map(function, values, jobs):
+    """Yields (index, exit code, output, errors) of function for each value.
+
+    The calls are made by jobs threads and yielded as they are done. The
+    output of each call is collected by swapping sys.stdout and sys.stderr
+    for files writing to the current call of the thread.
+
+    """
+    tasks = Queue.Queue()
+    for item in enumerate(values):
+        tasks.put(item)
+    results = Queue.Queue()
+    local = threading.local()
+    stopped = threading.Event()
+
+    def work():
+        while not stopped.is_set():
+            try:
+                index, value = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            local.stdout = StringIO.StringIO()
+            local.stderr = StringIO.StringIO()
+            code = _call_exit_code(function, value)
+            results.put((index, code, local.stdout.getvalue(),
+                         local.stderr.getvalue()))
+
+    streams = sys.stdout, sys.stderr
+    sys.stdout = _ThreadOutput(local, 'stdout', streams[0])
+    sys.stderr = _ThreadOutput(local, 'stderr', streams[1])
+    try:
+        for _ in range(jobs):
+            worker = threading.Thread(target=work)
+            worker.daemon = True
+            worker.start()
+        for _ in values:
+            # A timeout keeps the wait interruptible by Ctrl-C
+            yield results.get(True, 365 * 24 * 3600)
+    finally:
+        stopped.set()
+        sys.stdout, sys.stderr = streams
+
+
+class _ThreadOutput(object):
+    """A write only file writing to a file of the current thread"""
+    def __init__(self, local, name, default):
+        self.local = local
+        self.name = name
+        self.default = default
+
+    def __getattr__(self, name):
+        return getattr(self.file(), name)
+
+    def file(self):
+        return getattr(self.local, self.name, None) or self.default
+
+    # The print statement keeps its state in softspace, which has to be that
+    # of the file of the thread
+    @property
+    def softspace(self):
+        return getattr(self.file(), 'softspace', 0)
+
+    @softspace.setter
+    def softspace(self, value):
+        self.file().softspace = value
+
+    def write(self, data):
+        self.file().write(data)
+
+
+def fork_map(function, values, jobs):
+    """Yields (index, exit code, output, errors) of function for each value.
+
+    Each call is made in a forked process, jobs at a time, and yielded as
+    they are done. The processes write their output to temporary files.
+
+    """
+    items = enumerate(values)
+    running = {}
+    try:
+        while True:
+            for index, value in items:
+                out = tempfile.TemporaryFile()
+                err = tempfile.TemporaryFile()
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if not pid:
+                    _run_forked(function, value, out, err)
+                running[pid] = index, out, err
+                if len(running) >= jobs:
+                    break
+            if not running:
+                return
+            pid, status = _wait_any(running)
+            index, out, err = running.pop(pid)
+            yield (index, _status_code(status), _read_file(out),
+                   _read_file(err))
+    finally:
+        for pid in running:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+
+def _wait_any(pids):
+    """Returns (pid, status) of the first of the child pids to exit.
+
+    Other children of the process, like those of subprocess, are left to be
+    waited for by their owners.
+
+    """
+    delay = 0.001
+    while True:
+        for pid in pids:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                return pid, status
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+
+def _run_forked(function, value, out, err):
+    code = 1
+    try:
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        sys.stdout, sys.stderr = out, err
+        code = _call_exit_code(function, value)
+    finally:
+        out.flush()
+        err.flush()
+        os._exit(code & 0xff)
+
+
+def _status_code(status):
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _read_file(f):
+    f.seek(0)
+    data = f.read()
+    f.close()
+    return data
+
+
+def in_order(results):
+    """Yields the results of thread_map or fork_map in the order of index"""
+    pending = {}
+    index = 0
+    for result in results:
+        pending[result[0]] = result
+        while index in pending:
+            yield pending.pop(index)
+            index += 1
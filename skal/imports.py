@@ -0,0 +1,70 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Deferring the imports of command modules.
+
+Command modules are imported to find their commands, and so are the modules
+they import at the top, even when none of their commands is run. A module
+from lazy_import is only imported when one of its attributes is first used,
+like in the body of a command:
+
+    from skal import command, lazy_import
+
+    numpy = lazy_import('numpy')
+
+    @command
+    def mean(**args):
+        print(numpy.mean([1, 2, 3]))
+
+The imports worth deferring are found with SKAL_TIMINGS set, which times the
+modules each command module imports, nested under its own import.
+
+"""
+
+
+import sys
+import types
+
+
+def lazy_import(name):
+    """Returns the module name, imported when an attribute is first used.
+
+    A module that is already imported is returned as is.
+
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+class LazyModule(types.ModuleType):
+    """A module imported when one of its attributes is first used.
+
+    The attributes of the module are then copied, so later uses don't go
+    through the stand-in. Import errors are raised by that first use.
+
+    """
+    def __getattr__(self, name):
+        return getattr(self.__load(), name)
+
+    def __load(self):
+        __import__(self.__name__)
+        module = sys.modules[self.__name__]
+        self.__dict__.update(module.__dict__)
+        return module
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self.__name__
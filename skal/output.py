@@ -0,0 +1,163 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Writing the items yielded by streaming commands.
+
+A command that is a generator has the items it yields written one per line
+in one of the FORMATS:
+
+lines -- Strings as they are, other items with str
+jsonl -- One JSON document per item
+csv   -- Comma separated values, with lists and tuples as rows, dicts as
+         rows under a header of the keys of the first and other items alone
+tsv   -- Tab separated values, like csv
+
+The lines are gathered and written in chunks of BUFFER_SIZE bytes, and the
+command only runs as fast as its output is consumed, so memory stays flat
+however much it yields. When the reader goes away, like head does, the
+command is closed and nothing more is written.
+
+"""
+
+
+import os
+import sys
+import csv
+import json
+import errno
+import collections
+
+
+FORMATS = ['lines', 'jsonl', 'csv', 'tsv']
+
+BUFFER_SIZE = 64 * 1024
+
+# The exit code of a process killed by SIGPIPE
+BROKEN_PIPE = 141
+
+
+def write(items, format='lines', stream=None):
+    """Writes items in format to stream (default sys.stdout).
+
+    Returns the exit code, BROKEN_PIPE if the stream was closed before all
+    items were written.
+
+    """
+    stream = stream or sys.stdout
+    writer = _Writer(stream)
+    write_item = _FORMATTERS[format](writer)
+    try:
+        try:
+            for item in items:
+                write_item(item)
+            writer.flush()
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+        _discard(stream)
+        return BROKEN_PIPE
+    return 0
+
+
+class _Writer(object):
+    """A write only file writing to a stream in chunks of BUFFER_SIZE"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            data = ''.join(self.chunks)
+            self.chunks = []
+            self.size = 0
+            self.stream.write(data)
+        self.stream.flush()
+
+
+def _lines(writer):
+    def write_item(item):
+        if not isinstance(item, basestring):
+            item = str(item)
+        writer.write(item)
+        writer.write('\n')
+    return write_item
+
+
+def _jsonl(writer):
+    def write_item(item):
+        writer.write(json.dumps(item))
+        writer.write('\n')
+    return write_item
+
+
+def _table(delimiter):
+    def formatter(writer):
+        rows = csv.writer(writer, delimiter=delimiter, lineterminator='\n')
+        keys = []
+
+        def write_item(item):
+            if isinstance(item, dict):
+                if not keys:
+                    if isinstance(item, collections.OrderedDict):
+                        keys.extend(item)
+                    else:
+                        keys.extend(sorted(item))
+                    rows.writerow([_encode(key) for key in keys])
+                item = [item.get(key) for key in keys]
+            elif not isinstance(item, (list, tuple)):
+                item = [item]
+            rows.writerow([_encode(value) for value in item])
+        return write_item
+    return formatter
+
+
+def _encode(value):
+    # The csv module of Python 2 only writes byte strings
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _discard(stream):
+    # Later writes, like the flush at exit, then go nowhere instead of failing
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, IOError, ValueError):
+        return
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, fileno)
+    finally:
+        os.close(devnull)
+
+
+_FORMATTERS = {
+    'lines': _lines,
+    'jsonl': _jsonl,
+    'csv': _table(','),
+    'tsv': _table('\t'),
+}
@@ -0,0 +1,126 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Profiling of commands run by a SkalApp.
+
+A command is profiled either with cProfile, writing pstats files, or by
+sampling the stack of the thread running it, writing collapsed stacks that
+flamegraph.pl and similar tools take as input. Both only see the thread
+calling the command.
+
+"""
+
+
+import os
+import re
+import sys
+import time
+import thread
+import cProfile
+import threading
+
+
+# The longest label put in the name of a profile
+LABEL_LENGTH = 100
+
+
+def run(function, label, path, profiler='cprofile'):
+    """Calls function with a profiler, writing the profile to path.
+
+    If path is a directory the file is named after the label and the time.
+    A pstats file can't hold the label, which is written next to it, to the
+    path with .label added. Returns the return value of function.
+
+    Keyword arguments:
+    profiler -- 'cprofile' or 'sample' (default 'cprofile')
+
+    """
+    sample = profiler == 'sample'
+    path = _output_path(path, label, 'folded' if sample else 'pstats')
+    if sample:
+        profile = Sampler(label)
+    else:
+        profile = cProfile.Profile()
+    try:
+        return profile.runcall(function)
+    finally:
+        profile.dump_stats(path)
+        if not sample:
+            with open(path + '.label', 'w') as f:
+                f.write(label + '\n')
+        sys.stderr.write('Profile of "%s" written to %s\n' % (label, path))
+
+
+class Sampler(object):
+    """Samples the stack of the thread running a function at an interval"""
+    def __init__(self, label, interval=0.005):
+        """Keyword arguments:
+        label    -- Name of the root of all stacks
+        interval -- Seconds between samples (default 0.005)
+
+        """
+        self.label = label.replace(';', ',')
+        self.interval = interval
+        self.stacks = {}
+
+    def runcall(self, function, *args, **kwargs):
+        ident = thread.get_ident()
+        top = sys._getframe()
+        done = threading.Event()
+
+        def sample():
+            while True:
+                done.wait(self.interval)
+                if done.is_set():
+                    return
+                self.add(sys._current_frames().get(ident), top)
+        sampler = threading.Thread(target=sample)
+        sampler.daemon = True
+        sampler.start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            done.set()
+            sampler.join()
+
+    def add(self, frame, top):
+        """Counts the stack of frame up to, but not including, top"""
+        names = []
+        while frame is not None and frame is not top:
+            code = frame.f_code
+            names.append('%s (%s:%d)' % (
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno))
+            frame = frame.f_back
+        if frame is None or not names:
+            return
+        stack = ';'.join([self.label] + names[::-1])
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def dump_stats(self, path):
+        """Writes one line of the stack and its count for each stack"""
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (stack, count))
+
+
+def _output_path(path, label, extension):
+    if not os.path.isdir(path):
+        return path
+    # The label without the characters file names can't or shouldn't have
+    label = re.sub(r'[^\w.,=+-]+', '_', label)[:LABEL_LENGTH]
+    name = '%s-%s-%d.%s' % (label, time.strftime('%Y%m%d-%H%M%S'),
+                            os.getpid(), extension)
+    return os.path.join(path, name)
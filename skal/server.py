@@ -0,0 +1,332 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Serving a SkalApp from a resident process.
+
+The app is built once and then runs the command lines sent by skal.client,
+reusing its parsers and imported modules. Requests are handled one at a time
+as the working directory, environment and standard streams of the process
+are switched to those of the client while a command runs.
+
+The fork server instead runs each request in a fork of a fully loaded app,
+so requests are isolated from each other and can run at the same time.
+
+"""
+
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import thread
+import threading
+import Queue
+
+from .client import send, recv
+from .core import SkalApp, _from_json, _call_exit_code
+
+
+class Server(object):
+    """Runs the command lines of clients with one SkalApp"""
+    def __init__(self, app, path):
+        """Binds the unix socket at path.
+
+        A stale socket file left by a server that is gone is replaced.
+
+        """
+        self.app = app
+        self.path = path
+        if os.path.exists(path):
+            if _is_served(path):
+                raise RuntimeError('"%s" is already served' % path)
+            os.unlink(path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        os.chmod(path, 0o600)
+        self.socket.listen(16)
+        self.requests = 0
+        self.request_time = 0.0
+
+    def serve_forever(self):
+        """Handles requests until interrupted"""
+        try:
+            while True:
+                self.handle_request()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def handle_request(self):
+        conn, _ = self.socket.accept()
+        try:
+            kind, data = recv(conn)
+            if kind == 'a':
+                self.handle(conn, _from_json(json.loads(data)))
+            elif kind == 's':
+                send(conn, 'o', json.dumps(self.stats()))
+                send(conn, 'x', '0')
+        except socket.error as e:
+            if e.errno != errno.EPIPE:
+                raise
+        finally:
+            conn.close()
+
+    def handle(self, conn, request):
+        start = time.time()
+        code = self.run(conn, request)
+        send(conn, 'x', str(code))
+        self.requests += 1
+        self.request_time += time.time() - start
+
+    def stats(self):
+        """Returns a dict of the number of requests and mean times"""
+        return {
+            'requests': self.requests,
+            'request_time': self.request_time / (self.requests or 1),
+        }
+
+    def run(self, conn, request):
+        """Runs the command line of a request, returns the exit code"""
+        inputs = Queue.Queue()
+        state = {'done': False, 'interrupted': False}
+        lock = threading.Lock()
+        interrupt = isinstance(threading.current_thread(),
+                               threading._MainThread)
+        reader = threading.Thread(target=_read_client,
+                                  args=(conn, inputs, state, lock, interrupt))
+        reader.daemon = True
+        reader.start()
+
+        stdin_tty, stdout_tty, stderr_tty = request.get('tty', [False] * 3)
+        streams = sys.stdin, sys.stdout, sys.stderr
+        cwd = os.getcwd()
+        env = dict(os.environ)
+        try:
+            try:
+                sys.stdin = _Input(conn, inputs, stdin_tty)
+                sys.stdout = _Output(conn, 'o', stdout_tty)
+                sys.stderr = _Output(conn, 'e', stderr_tty)
+                os.chdir(request['cwd'])
+                os.environ.clear()
+                os.environ.update(request['env'])
+                return _run(self.app, request['argv'])
+            finally:
+                _stop_interrupts(state, lock)
+                os.environ.clear()
+                os.environ.update(env)
+                os.chdir(cwd)
+                sys.stdin, sys.stdout, sys.stderr = streams
+        except KeyboardInterrupt:
+            # The client interrupted as the command finished, only a signal
+            # of the server stops it
+            if not state['interrupted']:
+                raise
+            return 130
+
+    def close(self):
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class ForkServer(Server):
+    """Runs each command line in a fork of one fully loaded SkalApp"""
+    def __init__(self, app, path):
+        """Loads the app and binds the unix socket at path.
+
+        The app may also be a class or function creating it, the time taken to
+        create and load it is then the startup time of the stats, the cost a
+        cold start would add to starting Python.
+
+        """
+        start = time.time()
+        if not isinstance(app, SkalApp):
+            app = app()
+        app.preload()
+        self.startup = time.time() - start
+        self.forks = 0
+        self.fork_time = 0.0
+        Server.__init__(self, app, path)
+
+    def handle_request(self):
+        self.reap()
+        Server.handle_request(self)
+
+    def handle(self, conn, request):
+        start = time.time()
+        pid = os.fork()
+        if pid:
+            self.forks += 1
+            self.fork_time += time.time() - start
+            return
+        code = 1
+        try:
+            self.socket.close()
+            code = self.run(conn, request)
+            send(conn, 'x', str(code))
+        finally:
+            os._exit(code & 0xff)
+
+    def reap(self):
+        """Collects the exit status of finished children"""
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0]:
+                pass
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+
+    def stats(self):
+        """Returns a dict of the startup time, forks and mean fork time"""
+        return {
+            'startup': self.startup,
+            'forks': self.forks,
+            'fork_time': self.fork_time / (self.forks or 1),
+        }
+
+    def close(self):
+        Server.close(self)
+        self.reap()
+
+
+def serve(app, path, fork=False):
+    """Serves app on the unix socket at path until interrupted.
+
+    Keyword arguments:
+    fork -- Run each command line in a fork of the app (default False)
+
+    """
+    (ForkServer if fork else Server)(app, path).serve_forever()
+
+
+def _run(app, args):
+    return _call_exit_code(app.run, args)
+
+
+def _stop_interrupts(state, lock):
+    """Marks the request done, so the reader no longer interrupts it.
+
+    An interrupt the reader made just before is raised here, and ignored.
+
+    """
+    while True:
+        try:
+            with lock:
+                state['done'] = True
+            return
+        except KeyboardInterrupt:
+            if not state['interrupted']:
+                raise
+
+
+def _read_client(conn, inputs, state, lock, interrupt):
+    while True:
+        try:
+            kind, data = recv(conn)
+        except socket.error:
+            kind = None
+        if kind == 'i':
+            inputs.put(data)
+            continue
+        if kind is None:
+            # Unblock a pending read of a client that is gone
+            inputs.put('')
+        with lock:
+            if not state['done'] and interrupt:
+                state['interrupted'] = True
+                thread.interrupt_main()
+        if kind is None:
+            return
+
+
+def _is_served(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class _Output(object):
+    """A write only file relaying to the client"""
+    def __init__(self, conn, kind, tty):
+        self.conn = conn
+        self.kind = kind
+        self.tty = tty
+        self.softspace = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if data:
+            send(self.conn, self.kind, data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.tty
+
+
+class _Input(object):
+    """A read only file reading from the client when needed"""
+    def __init__(self, conn, inputs, tty):
+        self.conn = conn
+        self.inputs = inputs
+        self.tty = tty
+        self.buffer = ''
+        self.eof = False
+
+    def _fill(self):
+        if not self.eof:
+            send(self.conn, 'r', '65536')
+            data = self.inputs.get()
+            self.buffer += data
+            self.eof = not data
+        return not self.eof
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) < size) and self._fill():
+            pass
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self):
+        while '\n' not in self.buffer and self._fill():
+            pass
+        end = self.buffer.find('\n') + 1 or len(self.buffer)
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        return line
+
+    def readlines(self):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def isatty(self):
+        return self.tty
@@ -0,0 +1,159 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Timings of the phases of loading and running a SkalApp.
+
+Every SkalApp records its phases with the timings of this module, enabled by
+the SKAL_TIMINGS environment variable, see Timings.
+
+"""
+
+
+import os
+import sys
+import json
+import time
+import threading
+import __builtin__
+
+
+class Timings(object):
+    """Records the wall and CPU time of the phases of loading and running.
+
+    Enabled by setting the SKAL_TIMINGS environment variable to 'table' or to
+    'json', for JSON lines. The report is written to stderr at the end of each
+    run. Phases measured within another phase, like the parsers of the
+    commands of a module, are reported one level deeper.
+
+    The CPU time is the processor time of the process on Unix, as given by
+    time.clock, which is the wall time on Windows.
+
+    The imports of command modules are traced, each module they import is
+    measured nested in their import.
+
+    """
+    def __init__(self, format):
+        self.format = format
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def measure(self, phase, name):
+        """Returns a context measuring the time of a phase of name"""
+        if not self.format:
+            return _no_timing
+        return _Timing(self, phase, name)
+
+    def trace_imports(self, name):
+        """Returns a context measuring the imports run by module name"""
+        if not self.format:
+            return _no_timing
+        return _ImportTracer(self, name)
+
+    def report(self, stream=None):
+        """Writes the records to stream (default sys.stderr) and clears them"""
+        if not self.format:
+            return
+        stream = stream or sys.stderr
+        with self.lock:
+            records = [r for r in self.records if r]
+            self.records = []
+        if self.format == 'json':
+            for depth, phase, name, wall, cpu in records:
+                stream.write(json.dumps({
+                    'phase': phase, 'name': name, 'depth': depth,
+                    'wall': wall, 'cpu': cpu}) + '\n')
+            return
+        totals = {}
+        stream.write('%-8s %10s %10s  %s\n' % (
+            'phase', 'wall ms', 'cpu ms', 'name'))
+        for depth, phase, name, wall, cpu in records:
+            stream.write('%-8s %10.2f %10.2f  %s%s\n' % (
+                phase, wall * 1000, cpu * 1000, '  ' * depth, name))
+            if not depth:
+                total = totals.setdefault(phase, [0.0, 0.0])
+                total[0] += wall
+                total[1] += cpu
+        for phase in sorted(totals):
+            wall, cpu = totals[phase]
+            stream.write('%-8s %10.2f %10.2f  (total)\n' % (
+                phase, wall * 1000, cpu * 1000))
+
+
+class _Timing(object):
+    def __init__(self, timings, phase, name):
+        self.timings = timings
+        self.phase = phase
+        self.name = name
+
+    def __enter__(self):
+        timings = self.timings
+        self.depth = getattr(timings.local, 'depth', 0)
+        timings.local.depth = self.depth + 1
+        with timings.lock:
+            # The slot keeps a phase before the phases measured within it
+            self.index = len(timings.records)
+            timings.records.append(None)
+        self.wall = time.time()
+        self.cpu = time.clock()
+
+    def __exit__(self, *exc_info):
+        timings = self.timings
+        record = (self.depth, self.phase, self.name,
+                  time.time() - self.wall, time.clock() - self.cpu)
+        with timings.lock:
+            if self.index < len(timings.records):
+                timings.records[self.index] = record
+        timings.local.depth = self.depth
+
+
+class _ImportTracer(object):
+    """Measures the imports run by the top level of a module.
+
+    Modules already imported are not measured, and the time of the others
+    includes the modules they import in turn.
+
+    """
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.original = __builtin__.__import__
+        __builtin__.__import__ = self.__import
+
+    def __exit__(self, *exc_info):
+        __builtin__.__import__ = self.original
+
+    def __import(self, name, globals=None, locals=None, fromlist=None,
+                 level=-1):
+        if ((globals or {}).get('__name__') != self.name or
+                name in sys.modules):
+            return self.original(name, globals, locals, fromlist, level)
+        label = '.' * max(level, 0) + name
+        with self.timings.measure('import', label):
+            return self.original(name, globals, locals, fromlist, level)
+
+
+class _NoTiming(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_no_timing = _NoTiming()
+timings = Timings(os.environ.get('SKAL_TIMINGS'))
@@ -55,6 +55,39 @@ class TestApp(SkalApp):
         if 'test' in args:
             print(args['test'])
 
+    @command
+    def fail(self, **args):
+        """failing command"""
+        print('fail')
+        return 1
+
+    @command({
+        ('-t', '--targets'): {'help': 'fan-out targets', 'nargs': '+',
+                              'fanout': True}
+    })
+    def fanout(self, targets, **args):
+        """fan-out command"""
+        print('fanout %s' % targets)
+        if targets == 'fail':
+            return 1
+
+    @command({
+        ('-t', '--targets'): {'help': 'fan-out targets', 'nargs': '+',
+                              'fanout': True}
+    })
+    def words(self, targets, **args):
+        """fan-out command printing words"""
+        for i in range(20):
+            print targets, i
+
+    @command({
+        '-n': {'help': 'number of rows', 'type': int, 'default': 2}
+    })
+    def rows(self, n, **args):
+        """streaming command"""
+        for i in range(n):
+            yield {'n': i, 'name': 'row %d' % i}
+
     @command
     def ctrlc(self, **args):
         """ctrl c test"""
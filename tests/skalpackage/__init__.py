@@ -0,0 +1,10 @@
+"""package help string"""
+
+
+from skal import command
+
+
+@command
+def package_command(**args):
+    """package command"""
+    print('package_command')
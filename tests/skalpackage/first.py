@@ -0,0 +1,10 @@
+"""first module"""
+
+
+from skal import command
+
+
+@command
+def first_command(**args):
+    """first module command"""
+    print('first_command')
@@ -0,0 +1 @@
+"""nested package"""
@@ -0,0 +1,10 @@
+"""deep module"""
+
+
+from skal import command
+
+
+@command
+def deep_command(**args):
+    """deep module command"""
+    print('deep_command')
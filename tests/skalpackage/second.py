@@ -0,0 +1,14 @@
+"""second module"""
+
+
+from skal import command
+
+
+@command({
+    '-i': {'help': 'bool argument', 'action': 'store_true'}
+})
+def second_command(**args):
+    """second module command"""
+    print('second_command')
+    if args['i']:
+        print('i')
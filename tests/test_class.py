@@ -14,10 +14,18 @@
 
 
 from nose.tools import with_setup
+import os
+import json
+import time
+import errno
+import subprocess
 import inspect
+import argparse
+import StringIO
 from helpers import OutputCapture
 import skalclass
 from skalclass import TestApp
+from skal import SkalApp, command
 
 
 capture = OutputCapture(debug=False)
@@ -222,11 +230,32 @@ def test_command_doc():
 
 @with_setup(capture.start, capture.stop)
 def test_command_no_doc():
+    assert TestApp().lint() == 1, 'exit code should be 1'
+    assert 'no_doc' in capture.stderr.getvalue(), (
+        'there should be a warning about missing documentation')
+    assert 'first' not in capture.stderr.getvalue(), (
+        'there should be no warning about documented commands')
+
+
+@with_setup(capture.start, capture.stop)
+def test_command_no_doc_run():
     args = ['-h']
     try:
         TestApp().run(args)
     except SystemExit as e:
         assert e.code == 0, 'exit code should be 0'
+    assert 'no_doc' not in capture.stderr.getvalue(), (
+        'documentation should only be checked by lint')
+
+
+@with_setup(capture.start, capture.stop)
+def test_lint_environment():
+    os.environ['SKAL_LINT'] = '1'
+    try:
+        assert TestApp().run(['first']) == 1, 'exit code should be 1'
+    finally:
+        del os.environ['SKAL_LINT']
+    assert capture.stdout.getvalue() == '', 'command should not be run'
     assert 'no_doc' in capture.stderr.getvalue(), (
         'there should be a warning about missing documentation')
 
@@ -304,3 +333,407 @@ def test_command_argument_value_bool_and_string():
         'output should contain "%s"' % value1)
     assert value2 in capture.stdout.getvalue(), (
         'output should contain "%s"' % value2)
+
+
+# Lazy parser tests
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_parsers_command_existing():
+    value = 'first'
+    args = ['-b', value]
+    TestApp(lazy_parsers=True).run(args)
+    assert value in capture.stdout.getvalue(), (
+        'output should contain "%s"' % value)
+
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_parsers_command_argument_value_string():
+    value = 'test'
+    args = ['third', '--test=' + value]
+    TestApp(lazy_parsers=True).run(args)
+    assert value in capture.stdout.getvalue(), (
+        'output should contain "%s"' % value)
+
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_parsers_help():
+    args = ['-h']
+    try:
+        TestApp(lazy_parsers=True).run(args)
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    doc = inspect.getdoc(TestApp.first)
+    assert doc in capture.stdout.getvalue(), (
+        'help string should be "%s"' % doc)
+
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_parsers_command_help():
+    args = ['third', '-h']
+    try:
+        TestApp(lazy_parsers=True).run(args)
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    arg = '--test'
+    assert arg in capture.stdout.getvalue(), (
+        'help should list argument "%s"' % arg)
+
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_parsers_only_selected_built():
+    app = TestApp(lazy_parsers=True)
+    app.run(['first'])
+    parsers = app._SkalApp__subparser._name_parser_map
+    assert not isinstance(parsers['third'], argparse.ArgumentParser), (
+        'parsers of other commands should not be built')
+    assert isinstance(parsers['first'], argparse.ArgumentParser), (
+        'parser of the selected command should be built')
+
+
+# Prefix tests
+
+@with_setup(capture.start, capture.stop)
+def test_prefix_command():
+    args = ['thi', '-i']
+    TestApp().run(args)
+    assert capture.stdout.getvalue() == 'third\ni\nNone\n', (
+        'a unique prefix should run its command')
+
+
+@with_setup(capture.start, capture.stop)
+def test_prefix_command_lazy_parsers():
+    args = ['thi', '--test=x']
+    TestApp(lazy_parsers=True).run(args)
+    assert capture.stdout.getvalue() == 'third\ni\nx\n', (
+        'a unique prefix should run its command')
+
+
+@with_setup(capture.start, capture.stop)
+def test_prefix_ambiguous():
+    args = ['f']
+    try:
+        TestApp().run(args)
+    except SystemExit as e:
+        assert e.code != 0, 'exit code should not be 0'
+    assert 'could match fail, fanout, first' in capture.stderr.getvalue(), (
+        'error should list the commands of an ambiguous prefix')
+
+
+@with_setup(capture.start, capture.stop)
+def test_prefix_suggestion():
+    args = ['thrid']
+    try:
+        TestApp().run(args)
+    except SystemExit as e:
+        assert e.code != 0, 'exit code should not be 0'
+    assert "did you mean 'third'?" in capture.stderr.getvalue(), (
+        'error should suggest the closest command')
+
+
+def test_trie():
+    from skal import core
+    trie = core._Trie(['cmd_1', 'cmd_10', 'cmd_2', 'other'])
+    assert trie.resolve('o') == 'other', 'unique prefix should resolve'
+    assert trie.resolve('cmd_1') is None, 'ambiguous prefix should not'
+    assert trie.resolve('cmd_10') == 'cmd_10', 'name should resolve'
+    assert core._Trie(['only']).resolve('') is None, (
+        'empty prefix should not resolve')
+    assert trie.complete('cmd') == ['cmd_1', 'cmd_10', 'cmd_2'], (
+        'names with a prefix should be completed')
+    assert trie.suggest('cmd_3', 1) == ['cmd_1', 'cmd_2'], (
+        'names one edit away should be suggested')
+    assert trie.suggest('xyz', 1) == [], 'distant names should not'
+
+
+# Streaming tests
+
+@with_setup(capture.start, capture.stop)
+def test_stream_format():
+    TestApp(format='jsonl').run(['rows'])
+    rows = [json.loads(line)
+            for line in capture.stdout.getvalue().splitlines()]
+    assert rows == [{'n': 0, 'name': 'row 0'}, {'n': 1, 'name': 'row 1'}], (
+        'items should be written in the format of the app')
+
+
+@with_setup(capture.start, capture.stop)
+def test_stream_format_argument():
+    TestApp(format='jsonl').run(['--format', 'csv', 'rows', '-n', '3'])
+    assert capture.stdout.getvalue() == (
+        'n,name\n0,row 0\n1,row 1\n2,row 2\n'), (
+        'items should be written in the format of the argument')
+
+
+@with_setup(capture.start, capture.stop)
+def test_stream_tsv():
+    from skal import output
+    stream = StringIO.StringIO()
+    output.write(iter([['a', 1], (u'\xe9', None), 'b']), 'tsv', stream)
+    assert stream.getvalue() == 'a\t1\n\xc3\xa9\t\nb\n', (
+        'rows should be tab separated and encoded')
+
+
+@with_setup(capture.start, capture.stop)
+def test_stream_lines_buffered():
+    from skal import output
+    stream = StreamSpy()
+    code = output.write((i for i in xrange(100000)), 'lines', stream)
+    assert code == 0, 'exit code should be 0'
+    assert stream.getvalue() == ''.join('%d\n' % i for i in range(100000)), (
+        'items should be written one per line')
+    assert stream.writes < 20, 'output should be written in large chunks'
+
+
+@with_setup(capture.start, capture.stop)
+def test_stream_broken_pipe():
+    from skal import output
+    closed = []
+
+    def items():
+        try:
+            while True:
+                yield 'x' * 1024
+        finally:
+            closed.append(True)
+    stream = StreamSpy(limit=3)
+    code = output.write(items(), 'lines', stream)
+    assert code == output.BROKEN_PIPE, 'exit code should be that of SIGPIPE'
+    assert closed, 'command should be closed'
+
+
+class StreamSpy(object):
+    """A file counting writes, failing like a closed pipe after limit"""
+    def __init__(self, limit=None):
+        self.file = StringIO.StringIO()
+        self.writes = 0
+        self.limit = limit
+
+    def write(self, data):
+        self.writes += 1
+        if self.writes == self.limit:
+            raise IOError(errno.EPIPE, 'Broken pipe')
+        self.file.write(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return self.file.getvalue()
+
+
+# Chain tests
+
+@with_setup(capture.start, capture.stop)
+def test_chain_commands():
+    args = ['first', '+', 'third', '-i']
+    TestApp(chain='+').run(args)
+    assert capture.stdout.getvalue().startswith('first\n'), (
+        'first command should be run first')
+    assert capture.stdout.getvalue().endswith('third\ni\nNone\n'), (
+        'second command should be run with its arguments')
+
+
+@with_setup(capture.start, capture.stop)
+def test_chain_shared_arguments():
+    value = 'test'
+    args = ['--string=' + value, 'args_unpack', '+', 'args_unpack']
+    TestApp(chain='+').run(args)
+    assert capture.stdout.getvalue() == '%s\n%s\n' % (value, value), (
+        'global arguments should be passed on in the chain')
+
+
+@with_setup(capture.start, capture.stop)
+def test_chain_override_arguments():
+    args = ['-s', 'one', 'args_unpack', '+', '-s', 'two', 'args_unpack']
+    TestApp(chain='+').run(args)
+    assert capture.stdout.getvalue() == 'one\ntwo\n', (
+        'global arguments should be overridable in the chain')
+
+
+@with_setup(capture.start, capture.stop)
+def test_chain_parse_error():
+    args = ['first', '+', 'other']
+    try:
+        TestApp(chain='+').run(args)
+    except SystemExit as e:
+        assert e.code != 0, 'exit code should not be 0'
+    assert capture.stdout.getvalue() == '', (
+        'no command should be run when one can not be parsed')
+
+
+@with_setup(capture.start, capture.stop)
+def test_chain_keep_going():
+    args = ['fail', '+', '-b', 'args_unpack']
+    result = TestApp(chain='+').run(args)
+    assert capture.stdout.getvalue() == 'fail\nb\n', (
+        'commands after a failure should be run')
+    assert result is None, 'result should be of the last command'
+
+
+@with_setup(capture.start, capture.stop)
+def test_chain_stop_on_error():
+    args = ['fail', '+', 'first']
+    result = TestApp(chain='+', stop_on_error=True).run(args)
+    assert capture.stdout.getvalue() == 'fail\n', (
+        'commands after a failure should not be run')
+    assert result == 1, 'result should be of the failing command'
+
+
+# Fan-out tests
+
+@with_setup(capture.start, capture.stop)
+def test_fanout():
+    args = ['fanout', '-t', 'a', 'b', 'c']
+    code = TestApp().run(args)
+    assert code == 0, 'exit code should be 0'
+    assert capture.stdout.getvalue() == 'fanout a\nfanout b\nfanout c\n', (
+        'command should run once per value, in order')
+
+
+@with_setup(capture.start, capture.stop)
+def test_fanout_jobs():
+    values = [str(i) for i in range(20)]
+    TestApp(jobs=2).run(['-j', '8', 'fanout', '-t'] + values)
+    assert capture.stdout.getvalue() == ''.join(
+        'fanout %s\n' % value for value in values), (
+        'output should be in the order of the values')
+
+
+@with_setup(capture.start, capture.stop)
+def test_fanout_command_jobs():
+    TestApp().run(['fanout', '-t', 'a', 'b', '--jobs', '2'])
+    assert capture.stdout.getvalue() == 'fanout a\nfanout b\n', (
+        'jobs should be accepted after the command')
+
+
+@with_setup(capture.start, capture.stop)
+def test_fanout_as_completed():
+    TestApp(jobs=4).run(['--as-completed', 'fanout', '-t', 'a', 'b', 'c'])
+    lines = sorted(capture.stdout.getvalue().splitlines())
+    assert lines == ['fanout a', 'fanout b', 'fanout c'], (
+        'output of every call should be written')
+
+
+@with_setup(capture.start, capture.stop)
+def test_fanout_process():
+    args = ['fanout', '-t', 'a', 'b', 'c', '--pool', 'process', '-j', '2']
+    code = TestApp().run(args)
+    assert code == 0, 'exit code should be 0'
+    assert capture.stdout.getvalue() == 'fanout a\nfanout b\nfanout c\n', (
+        'output of the processes should be written in order')
+
+
+@with_setup(capture.start, capture.stop)
+def test_fanout_print_softspace():
+    targets = [str(i) for i in range(8)]
+    TestApp(jobs=8).run(['words', '-t'] + targets)
+    lines = capture.stdout.getvalue().splitlines()
+    assert lines == ['%s %d' % (t, i) for t in targets for i in range(20)], (
+        'print of concurrent calls should not share its softspace')
+
+
+@with_setup(capture.start, capture.stop)
+def test_fanout_process_other_children():
+    other = subprocess.Popen(['sh', '-c', 'exit 3'])
+    time.sleep(0.05)
+    TestApp().run(['fanout', '-t', 'a', 'b', '--pool', 'process'])
+    assert other.wait() == 3, (
+        'exit status of other children should be left to their owners')
+
+
+@with_setup(capture.start, capture.stop)
+def test_fanout_failure():
+    for pool in ['thread', 'process']:
+        args = ['fanout', '-t', 'a', 'fail', 'b', '--pool', pool]
+        code = TestApp().run(args)
+        assert code == 1, 'exit code should be 1'
+        assert 'fanout b' in capture.stdout.getvalue(), (
+            'values after a failure should run')
+        assert capture.stderr.getvalue().endswith(
+            'Error: item 2 failed: fail\n'
+            'Error: 1 of 3 items failed: fail\n'), (
+            'failed items should be reported')
+        capture.stop()
+        capture.start()
+
+
+@with_setup(capture.start, capture.stop)
+def test_fanout_help():
+    try:
+        TestApp(jobs=2).run(['-h'])
+    except SystemExit:
+        pass
+    assert '--jobs' in capture.stdout.getvalue(), (
+        'help should have the fan-out arguments')
+    capture.stop()
+    capture.start()
+    try:
+        TestApp().run(['-h'])
+    except SystemExit:
+        pass
+    assert '--jobs' not in capture.stdout.getvalue(), (
+        'fan-out arguments should only be added when asked for')
+
+
+def flag_command(f):
+    return command({'-i': {'action': 'store_true'}})(f)
+
+
+class WrappedApp(SkalApp):
+    """wrapped app"""
+
+    @flag_command
+    def wrapped(self, i):
+        """wrapped command"""
+        print('wrapped %s' % i)
+
+
+@with_setup(capture.start, capture.stop)
+def test_wrapped_decorator():
+    WrappedApp(version='0.1').run(['wrapped', '-i'])
+    assert capture.stdout.getvalue() == 'wrapped True\n', (
+        'commands of helpers should be found')
+
+
+# Fast parser tests
+
+def fast_and_argparse(app, args):
+    from skal import core
+    parser = app._SkalApp__parser
+    return core._fast_parse(parser, args), parser.parse_args(args)
+
+
+@with_setup(capture.start, capture.stop)
+def test_fast_parse_same_as_argparse():
+    app = TestApp(jobs=2)
+    for args in [['first'], ['-b', 'first'], ['-s', 'x', 'first'],
+                 ['--string=x', '-b', 'third', '-i', '-t', 'y'],
+                 ['-j', '3', '--pool', 'process', 'third', '--test=-y'],
+                 ['third', '-t', 'first']]:
+        fast, slow = fast_and_argparse(app, args)
+        assert fast is not None, '%s should be parsed fast' % args
+        assert vars(fast) == vars(slow), (
+            '%s should be parsed as %s, not %s' % (args, slow, fast))
+
+
+@with_setup(capture.start, capture.stop)
+def test_fast_parse_falls_back():
+    from skal import core
+    app = TestApp(jobs=2)
+    parser = app._SkalApp__parser
+    for args in [[], ['-h'], ['first', '--help'], ['--str', 'x', 'first'],
+                 ['-bs', 'x', 'first'], ['-sx', 'first'], ['other'],
+                 ['-j', 'x', 'first'], ['--pool', 'fork', 'first'],
+                 ['third', '-t'], ['third', '-t', '-i'], ['first', 'extra'],
+                 ['fanout', '-t', 'a', 'b'], ['first', '--', 'x']]:
+        assert core._fast_parse(parser, args) is None, (
+            '%s should be left to argparse' % args)
+
+
+@with_setup(capture.start, capture.stop)
+def test_fast_parse_fallback_chain():
+    args = ['-s', 'one', 'args_unpack', '+', '-s', 'two', '--str', 'three',
+            'args_unpack']
+    TestApp(chain='+').run(args)
+    assert capture.stdout.getvalue() == 'one\nthree\n', (
+        'argparse should parse the arguments the fast path left')
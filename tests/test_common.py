@@ -14,15 +14,88 @@
 
 
 from nose.tools import raises, with_setup
+from nose.plugins.skip import SkipTest
+import os
+import sys
+import time
+import pstats
+import shutil
+import tempfile
+import StringIO
+import subprocess
 from helpers import OutputCapture
 from skalclass import TestApp
-from skal import command, default
+from skal import SkalApp, command, default
+
+try:
+    import trollius as asyncio
+except ImportError:
+    asyncio = None
 
 
 __version__ = '0.1'
 
 
 capture = OutputCapture(debug=False)
+tempdir = None
+
+
+if asyncio:
+    class AsyncApp(SkalApp):
+        """coroutine commands"""
+
+        @command
+        @asyncio.coroutine
+        def wait(self):
+            """wait for a future"""
+            loop = asyncio.get_event_loop()
+            future = asyncio.Future(loop=loop)
+            loop.call_soon(future.set_result, 'waited')
+            result = yield asyncio.From(future)
+            print(result)
+            raise asyncio.Return(id(loop))
+
+        @command
+        @asyncio.coroutine
+        def ctrlc(self):
+            """ctrl c test"""
+            yield asyncio.From(asyncio.sleep(0))
+            raise KeyboardInterrupt
+
+
+class BusyApp(SkalApp):
+    """busy commands"""
+
+    @command({
+        '-n': {'help': 'seconds to spin', 'type': float, 'default': 0.05}
+    })
+    def spin(self, n):
+        """spin a while"""
+        end = time.time() + n
+        while time.time() < end:
+            pass
+
+
+def profile_setup():
+    global tempdir
+    tempdir = tempfile.mkdtemp()
+    capture.start()
+
+
+def profile_teardown():
+    capture.stop()
+    shutil.rmtree(tempdir)
+
+
+def async_setup():
+    if not asyncio:
+        raise SkipTest('trollius is not installed')
+    capture.start()
+
+
+def new_loop():
+    # A select based loop works everywhere the tests are run
+    return asyncio.SelectorEventLoop(asyncio.selectors.SelectSelector())
 
 
 # --- Test cases --------------------------------------------------------------
@@ -69,6 +142,47 @@ def test_decorator_with_tuple_argument():
         'metadata of ("-t", "--test") should be a dict')
 
 
+@with_setup(capture.start, capture.stop)
+def test_decorator_registers_class_commands():
+    class App(SkalApp):
+        @command
+        def first(self):
+            pass
+
+        @command({
+            '-t': {}
+        })
+        def second(self):
+            pass
+
+        def other(self):
+            pass
+    assert App.__skal_commands__ == ['first', 'second'], (
+        'commands should be registered in the class')
+
+
+@with_setup(capture.start, capture.stop)
+def test_decorator_registers_module_commands():
+    import skalmodule
+    assert 'first' in skalmodule.__skal_commands__, (
+        'commands should be registered in the module')
+    assert 'second' not in skalmodule.__skal_commands__, (
+        'functions should not be registered')
+
+
+@with_setup(capture.start, capture.stop)
+def test_inherited_commands():
+    class App(TestApp):
+        @command
+        def extra(self, **args):
+            """extra command"""
+            print('extra')
+    App().run(['fail'])
+    App().run(['extra'])
+    assert capture.stdout.getvalue() == 'fail\nextra\n', (
+        'commands of base classes should be found')
+
+
 @with_setup(capture.start, capture.stop)
 @raises(NotImplementedError)
 def test_decorator_default():
@@ -84,3 +198,157 @@ def test_decorator_default():
 def test_keyboard_interrupt():
     args = ['ctrlc']
     TestApp().run(args)
+
+
+# Batch tests
+
+@with_setup(capture.start, capture.stop)
+def test_batch():
+    source = StringIO.StringIO('first\n\n# comment\nthird -i -t foo\n')
+    code = TestApp().batch(source)
+    assert code == 0, 'exit code should be 0'
+    output = capture.stdout.getvalue()
+    assert output.startswith('first\n'), (
+        'output should contain the output of the first line')
+    assert output.endswith('third\ni\nfoo\n'), (
+        'output should contain the output of the last line')
+
+
+@with_setup(capture.start, capture.stop)
+def test_batch_program_name():
+    app = TestApp()
+    source = StringIO.StringIO('%s first\n' % app._SkalApp__parser.prog)
+    code = app.batch(source)
+    assert code == 0, 'exit code should be 0'
+    assert capture.stdout.getvalue().startswith('first\n'), (
+        'program name should be skipped')
+
+
+@with_setup(capture.start, capture.stop)
+def test_batch_stop_on_error():
+    source = StringIO.StringIO('first\nother\nthird\n')
+    code = TestApp().batch(source)
+    assert code == 1, 'exit code should be 1'
+    assert 'third' not in capture.stdout.getvalue(), (
+        'lines after a failure should not be run')
+    assert 'line 2 failed' in capture.stderr.getvalue(), (
+        'failing line should be reported')
+
+
+@with_setup(capture.start, capture.stop)
+def test_batch_keep_going():
+    source = StringIO.StringIO('first\nother\nthird\nmissing\n')
+    code = TestApp().batch(source, keep_going=True)
+    assert code == 1, 'exit code should be 1'
+    assert 'third' in capture.stdout.getvalue(), (
+        'lines after a failure should be run')
+    assert '2 of 4 lines failed: 2, 4' in capture.stderr.getvalue(), (
+        'summary should list the failing lines')
+
+
+# Coroutine tests
+
+@with_setup(async_setup, capture.stop)
+def test_coroutine_command():
+    loop = new_loop()
+    result = AsyncApp(loop=loop).run(['wait'])
+    assert capture.stdout.getvalue() == 'waited\n', (
+        'coroutine should be run to completion')
+    assert result == id(loop), 'coroutine should be run on the app loop'
+
+
+@with_setup(async_setup, capture.stop)
+def test_coroutine_shared_loop():
+    app = AsyncApp(loop=new_loop())
+    first = app.run(['wait'])
+    second = app.run(['wait'])
+    assert first == second, 'coroutines should share one loop'
+
+
+@with_setup(async_setup, capture.stop)
+@raises(KeyboardInterrupt)
+def test_coroutine_keyboard_interrupt():
+    AsyncApp(loop=new_loop()).run(['ctrlc'])
+
+
+@with_setup(async_setup, capture.stop)
+def test_coroutine_loop_after_interrupt():
+    app = AsyncApp(loop=new_loop())
+    try:
+        app.run(['ctrlc'])
+    except KeyboardInterrupt:
+        pass
+    app.run(['wait'])
+    assert 'waited' in capture.stdout.getvalue(), (
+        'loop should be usable after an interrupt')
+
+
+# Profile tests
+
+@with_setup(profile_setup, profile_teardown)
+def test_profile_cprofile():
+    path = os.path.join(tempdir, 'spin.pstats')
+    BusyApp(profile=True).run(['--profile', path, 'spin'])
+    stats = pstats.Stats(path)
+    names = [function for _, _, function in stats.stats]
+    assert 'spin' in names, 'profile should have the command'
+    assert 'Profile of "spin n=0.05" written to' in (
+        capture.stderr.getvalue()), 'profile should be labeled'
+    with open(path + '.label') as f:
+        assert f.read() == 'spin n=0.05\n', 'label should be written'
+
+
+@with_setup(profile_setup, profile_teardown)
+def test_profile_sample():
+    path = os.path.join(tempdir, 'spin.folded')
+    BusyApp(profile=True).run(
+        ['--profile', path, '--profiler', 'sample', 'spin'])
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines, 'stacks should be sampled'
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert stack.startswith('spin n=0.05;'), (
+            'stacks should start with the label')
+        assert int(count) > 0, 'stacks should be counted'
+    assert any('spin (test_common.py:' in line for line in lines), (
+        'stacks should have the command')
+
+
+@with_setup(profile_setup, profile_teardown)
+def test_profile_directory():
+    BusyApp(profile=True).run(['--profile', tempdir, 'spin', '-n', '0'])
+    names = sorted(os.listdir(tempdir))
+    assert len(names) == 2, 'profile should be written to the directory'
+    assert names[0].startswith('spin_n=0.0-'), (
+        'profile should be named after the command and its arguments')
+    assert names[0].endswith('.pstats'), 'profile should be a pstats file'
+    assert names[1] == names[0] + '.label', 'label should be written'
+
+
+# Import tests
+
+def test_import_decorators_only():
+    # A fresh interpreter, as this one has imported everything already
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', (
+        'import sys\n'
+        'sys.path.insert(0, %r)\n'
+        'from skal import command\n'
+        'print(sorted(sys.modules))\n' % root)])
+    for name in ['skal.core', 'argparse', 'inspect', 'json']:
+        assert repr(name) not in output, (
+            'importing the decorators should not import %s' % name)
+
+
+def test_import_app_on_demand():
+    import skal
+    from skal import core
+    assert skal.SkalApp is core.SkalApp, 'SkalApp should be the app class'
+    assert 'SkalApp' in skal.__all__, 'SkalApp should be exported'
+    try:
+        skal.missing
+    except AttributeError:
+        pass
+    else:
+        assert False, 'missing names should raise AttributeError'
@@ -0,0 +1,147 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from nose.tools import with_setup
+import os
+import sys
+import json
+import shutil
+import tempfile
+from helpers import OutputCapture
+from skalclass import TestApp
+from skal import SkalApp
+from skal import completion
+
+
+capture = OutputCapture(debug=False)
+tempdir = None
+index = None
+
+
+def completion_setup():
+    global tempdir, index
+    tempdir = tempfile.mkdtemp()
+    index = os.path.join(tempdir, 'index.json')
+    os.environ['SKAL_COMPLETION_INDEX'] = index
+    capture.start()
+
+
+def completion_teardown():
+    capture.stop()
+    os.environ.pop('SKAL_COMPLETION', None)
+    os.environ.pop('SKAL_COMPLETION_INDEX', None)
+    shutil.rmtree(tempdir)
+
+
+def generate(app, shell='index'):
+    os.environ['SKAL_COMPLETION'] = shell
+    try:
+        return app.run([])
+    finally:
+        os.environ.pop('SKAL_COMPLETION')
+
+
+# --- Test cases --------------------------------------------------------------
+
+
+@with_setup(completion_setup, completion_teardown)
+def test_script():
+    for shell in ['bash', 'zsh', 'fish']:
+        code = generate(TestApp(), shell)
+        assert code == 0, 'exit code should be 0'
+        output = capture.stdout.getvalue()
+        assert '-m skal.completion %s' % index in output, (
+            'script should complete from the index')
+        capture.stop()
+        capture.start()
+    assert os.path.exists(index), 'index should be written'
+
+
+@with_setup(completion_setup, completion_teardown)
+def test_script_unknown_shell():
+    code = generate(TestApp(), 'cmd')
+    assert code == 1, 'exit code should be 1'
+    assert 'no completion for shell "cmd"' in capture.stderr.getvalue(), (
+        'unknown shells should be reported')
+
+
+@with_setup(completion_setup, completion_teardown)
+def test_complete_commands():
+    generate(TestApp())
+    assert completion.complete(index, ['th']) == ['third'], (
+        'commands should be completed')
+    assert 'first' in completion.complete(index, ['']), (
+        'all commands should be listed')
+
+
+@with_setup(completion_setup, completion_teardown)
+def test_complete_options():
+    generate(TestApp())
+    options = completion.complete(index, ['-'])
+    assert '-b' in options and '--string' in options, (
+        'global options should be completed')
+    options = completion.complete(index, ['-b', 'third', '--'])
+    assert options == ['--help', '--test'], (
+        'options of the command should be completed')
+
+
+@with_setup(completion_setup, completion_teardown)
+def test_complete_option_values():
+    generate(TestApp(jobs=2))
+    assert completion.complete(index, ['--pool', '']) == [
+        'process', 'thread'], 'choices should be completed'
+    assert completion.complete(index, ['-s', 'fir']) == [], (
+        'values of options should not be completed as commands')
+
+
+@with_setup(completion_setup, completion_teardown)
+def test_complete_subcommands():
+    generate(SkalApp(subcommand_modules=['skalmodule'], lazy=True))
+    assert completion.complete(index, ['skalmodule', 'fi']) == ['first'], (
+        'subcommands should be completed')
+
+
+@with_setup(completion_setup, completion_teardown)
+def test_complete_without_import():
+    generate(SkalApp(command_modules=['skalmodule']))
+    module = sys.modules.pop('skalmodule')
+    try:
+        completion.complete(index, [''])
+        assert 'skalmodule' not in sys.modules, (
+            'completion should not import command modules')
+    finally:
+        sys.modules['skalmodule'] = module
+
+
+@with_setup(completion_setup, completion_teardown)
+def test_index_sources():
+    generate(SkalApp(subcommand_packages=['skalpackage']))
+    with open(index) as f:
+        sources = json.load(f)['sources']
+    assert any(path.endswith('first.py') for path in sources), (
+        'module files should be sources of the index')
+    package = [path for path in sources if path.endswith('skalpackage')]
+    assert package, 'package directories should be sources of the index'
+    with open(index) as f:
+        assert not completion._stale(json.load(f)), (
+            'index should be fresh')
+    stat = os.stat(package[0])
+    os.utime(package[0], (stat.st_atime, stat.st_mtime + 1))
+    try:
+        with open(index) as f:
+            assert completion._stale(json.load(f)), (
+                'changed sources should make the index stale')
+    finally:
+        os.utime(package[0], (stat.st_atime, stat.st_mtime))
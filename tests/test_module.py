@@ -15,12 +15,51 @@
 
 from nose.tools import with_setup
 import inspect
+import os
+import sys
+import shutil
+import time
+import tempfile
+import json
 from helpers import OutputCapture
-from skal import SkalApp
+from skal import SkalApp, command
+from skal.timings import timings
 
 
 capture = OutputCapture(debug=False)
 module = 'skalmodule'
+tempdir = None
+
+
+def temp_setup():
+    global tempdir
+    tempdir = tempfile.mkdtemp()
+    sys.path.insert(0, tempdir)
+    write_temp_module('first command')
+    capture.start()
+
+
+def temp_teardown():
+    capture.stop()
+    sys.path.remove(tempdir)
+    sys.modules.pop('skaltemp', None)
+    sys.modules.pop('skalcached', None)
+    sys.modules.pop('skalappmod', None)
+    sys.modules.pop('skalwrapped', None)
+    shutil.rmtree(tempdir)
+
+
+def write_temp_module(doc, spec="{'-i': {'action': 'store_true'}}",
+                      header='from skal import command',
+                      decorator='command'):
+    with open(os.path.join(tempdir, 'skaltemp.py'), 'w') as f:
+        f.write("%s\n\n\n"
+                "@%s(%s)\n"
+                "def first(**args):\n"
+                "    '''%s'''\n"
+                "    print('first %%s' %% args['i'])\n" % (
+                    header, decorator, spec, doc))
+    sys.modules.pop('skaltemp', None)
 
 
 # --- Test cases --------------------------------------------------------------
@@ -218,15 +257,28 @@ def test_command_doc():
 
 @with_setup(capture.start, capture.stop)
 def test_command_no_doc():
-    args = ['no_doc']
-    try:
-        SkalApp(command_modules=[module]).run(args)
-    except SystemExit as e:
-        assert e.code == 0, 'exit code should be 0'
+    code = SkalApp(command_modules=[module]).lint()
+    assert code == 1, 'exit code should be 1'
     assert 'no_doc' in capture.stderr.getvalue(), (
         'there should be a warning about missing documentation')
 
 
+@with_setup(capture.start, capture.stop)
+def test_command_no_source_lookup():
+    calls = []
+    getsourcefile = inspect.getsourcefile
+
+    def spy(item):
+        calls.append(item)
+        return getsourcefile(item)
+    inspect.getsourcefile = spy
+    try:
+        SkalApp(command_modules=[module, 'skalmodule_nodoc']).run(['first'])
+    finally:
+        inspect.getsourcefile = getsourcefile
+    assert calls == [], 'running a command should not look up sources'
+
+
 @with_setup(capture.start, capture.stop)
 def test_command_without_decorator():
     args = ['second']
@@ -299,11 +351,8 @@ def test_subcommand_doc():
 
 @with_setup(capture.start, capture.stop)
 def test_subcommand_no_doc():
-    args = ['-h']
-    try:
-        SkalApp(subcommand_modules=['skalmodule_nodoc']).run(args)
-    except SystemExit as e:
-        assert e.code == 0, 'exit code should be 0'
+    code = SkalApp(subcommand_modules=['skalmodule_nodoc'], lazy=True).lint()
+    assert code == 1, 'exit code should be 1'
     assert 'skalmodule_nodoc' in capture.stderr.getvalue(), (
         'there should be a warning about missing documentation')
 
@@ -374,11 +423,8 @@ def test_subcommand_command_doc():
 
 @with_setup(capture.start, capture.stop)
 def test_subcommand_command_no_doc():
-    args = [module, 'no_doc']
-    try:
-        SkalApp(subcommand_modules=[module]).run(args)
-    except SystemExit as e:
-        assert e.code == 0, 'exit code should be 0'
+    code = SkalApp(subcommand_modules=[module], lazy_parsers=True).lint()
+    assert code == 1, 'exit code should be 1'
     assert 'no_doc' in capture.stderr.getvalue(), (
         'there should be a warning about missing documentation')
 
@@ -390,3 +436,585 @@ def test_subcommand_command_without_decorator():
         SkalApp(command_modules=[module]).run(args)
     except SystemExit as e:
         assert e.code != 0, 'exit code should not be 0'
+
+
+# Lazy tests
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_command_existing():
+    value = 'first'
+    args = [value]
+    SkalApp(command_modules=[module, 'skalmodule_importerror'],
+            lazy=True).run(args)
+    assert value in capture.stdout.getvalue(), (
+        'output should contain "%s"' % value)
+    assert 'ImportError' not in capture.stderr.getvalue(), (
+        'modules after the owning module should not be imported')
+
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_subcommand_existing():
+    value = 'first'
+    args = [module, value]
+    SkalApp(subcommand_modules=['skalmodule_importerror', module],
+            lazy=True).run(args)
+    assert value in capture.stdout.getvalue(), (
+        'output should contain "%s"' % value)
+    assert 'ImportError' not in capture.stderr.getvalue(), (
+        'only the selected subcommand module should be imported')
+
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_help():
+    args = ['-h']
+    try:
+        SkalApp(command_modules=[module],
+                subcommand_modules=['skalmodule_nodoc'],
+                lazy=True).run(args)
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    assert 'first' in capture.stdout.getvalue(), (
+        'help should list commands from all modules')
+    assert 'skalmodule_nodoc' in capture.stdout.getvalue(), (
+        'help should list subcommands from all modules')
+
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_command_non_existing():
+    args = ['other']
+    try:
+        SkalApp(command_modules=[module], lazy=True).run(args)
+    except SystemExit as e:
+        assert e.code != 0, 'exit code should not be 0'
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_lazy_global_argument_of_pending_module():
+    for args in [['-b', 'first'], ['-s', 'foo', 'first'],
+                 ['--string=foo', 'first']]:
+        SkalApp(command_modules=['skaltemp', module], lazy=True).run(args)
+        assert capture.stdout.getvalue() == 'first False\n', (
+            'global arguments of pending modules should be accepted')
+        capture.stop()
+        capture.start()
+
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_subcommand_prefix():
+    value = 'first'
+    args = ['skalmod', 'fir']
+    SkalApp(subcommand_modules=[module], lazy=True).run(args)
+    assert value in capture.stdout.getvalue(), (
+        'output should contain "%s"' % value)
+
+
+# Manifest tests
+
+@with_setup(temp_setup, temp_teardown)
+def test_manifest_created():
+    manifest = os.path.join(tempdir, 'manifest.json')
+    SkalApp(command_modules=['skaltemp'], manifest=manifest).run(['first'])
+    assert os.path.exists(manifest), 'manifest should be written'
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_manifest_help_without_import():
+    manifest = os.path.join(tempdir, 'manifest.json')
+    SkalApp(command_modules=['skaltemp'], manifest=manifest)
+    sys.modules.pop('skaltemp')
+    try:
+        SkalApp(command_modules=['skaltemp'], manifest=manifest).run(['-h'])
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    assert 'first command' in capture.stdout.getvalue(), (
+        'help should be built from the manifest')
+    assert 'skaltemp' not in sys.modules, (
+        'module should not be imported for help')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_manifest_command_existing():
+    manifest = os.path.join(tempdir, 'manifest.json')
+    SkalApp(command_modules=['skaltemp'], manifest=manifest)
+    sys.modules.pop('skaltemp')
+    SkalApp(command_modules=['skaltemp'], manifest=manifest).run(
+        ['first', '-i'])
+    assert 'first True' in capture.stdout.getvalue(), (
+        'command from the manifest should be run with its arguments')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_manifest_stale_module():
+    manifest = os.path.join(tempdir, 'manifest.json')
+    SkalApp(command_modules=['skaltemp'], manifest=manifest)
+    write_temp_module('changed first command')
+    try:
+        SkalApp(command_modules=['skaltemp'], manifest=manifest).run(['-h'])
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    assert 'changed first command' in capture.stdout.getvalue(), (
+        'changed modules should be scanned again')
+
+
+# Static tests
+
+@with_setup(temp_setup, temp_teardown)
+def test_static_help_without_import():
+    try:
+        SkalApp(command_modules=['skaltemp'], static=True).run(['-h'])
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    assert 'first command' in capture.stdout.getvalue(), (
+        'help should be built from the source')
+    assert 'skaltemp' not in sys.modules, (
+        'module should not be imported for help')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_static_command_existing():
+    SkalApp(command_modules=['skaltemp'], static=True).run(['first', '-i'])
+    assert 'first True' in capture.stdout.getvalue(), (
+        'command should be run with its arguments')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_static_non_literal_arguments():
+    write_temp_module(
+        'first command', "{'-i': {'type': int}}")
+    try:
+        SkalApp(command_modules=['skaltemp'], static=True).run(['-h'])
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    assert 'skaltemp' in sys.modules, (
+        'module with non literal arguments should be imported')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_static_import_error_on_run():
+    write_temp_module('first command',
+                      header='from skal import command\nimport skal_missing')
+    for args in [['first'], ['--profile', tempdir, 'first']]:
+        app = SkalApp(command_modules=['skaltemp'], static=True, profile=True)
+        try:
+            app.run(args)
+        except SystemExit as e:
+            assert e.code == 1, 'exit code should be 1'
+        assert 'command "first" not found' in capture.stderr.getvalue(), (
+            'a command that fails to import should be reported')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_static_decorators_module():
+    write_temp_module('first command',
+                      header='from skal.decorators import command')
+    try:
+        SkalApp(command_modules=['skaltemp'], static=True).run(['-h'])
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    assert 'first command' in capture.stdout.getvalue(), (
+        'commands of skal.decorators should be found')
+    assert 'skaltemp' not in sys.modules, 'module should not be imported'
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_static_unknown_decorator_import():
+    write_temp_module('first command', header='from skal import decorators',
+                      decorator='decorators.command')
+    SkalApp(command_modules=['skaltemp'], static=True).run(['first'])
+    assert capture.stdout.getvalue() == 'first False\n', (
+        'module with a command decorator not understood should be imported')
+
+
+@with_setup(capture.start, capture.stop)
+def test_static_subcommand_doc():
+    args = [module, '-h']
+    try:
+        SkalApp(subcommand_modules=[module], static=True).run(args)
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    import skalmodule
+    doc = inspect.getdoc(skalmodule)
+    assert doc in capture.stdout.getvalue(), (
+        'help string should be "%s"' % doc)
+    assert '--string' in capture.stdout.getvalue(), (
+        'help should list module arguments')
+
+
+@with_setup(capture.start, capture.stop)
+def test_static_command_without_decorator():
+    args = ['second']
+    try:
+        SkalApp(command_modules=[module], static=True).run(args)
+    except SystemExit as e:
+        assert e.code != 0, 'exit code should not be 0'
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_wrapped_decorator():
+    with open(os.path.join(tempdir, 'skalwrapped.py'), 'w') as f:
+        f.write("from skal import command\n\n\n"
+                "def flag_command(f):\n"
+                "    return command({'-i': {'action': 'store_true'}})(f)\n\n\n"
+                "def make(word):\n"
+                "    @command\n"
+                "    def say(**args):\n"
+                "        '''say a word'''\n"
+                "        print(word)\n"
+                "    return say\n\n\n"
+                "@flag_command\n"
+                "def first(i):\n"
+                "    '''first command'''\n"
+                "    print('first %s' % i)\n\n\n"
+                "say = make('hello')\n")
+    app = SkalApp(command_modules=['skalwrapped'])
+    app.run(['first', '-i'])
+    app.run(['say'])
+    assert capture.stdout.getvalue() == 'first True\nhello\n', (
+        'commands of helpers and factories should be found')
+
+
+# Help cache tests
+
+def cached_help(args, **options):
+    cache = os.path.join(tempdir, 'help.json')
+    app = SkalApp(command_modules=['skaltemp'], lazy=True, help_cache=cache,
+                  **options)
+    sys.modules.pop('skaltemp', None)
+    try:
+        app.run(args)
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    output = capture.stdout.getvalue()
+    capture.stop()
+    capture.start()
+    return output
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_help_cache_command():
+    first = cached_help(['first', '-h'])
+    assert 'first command' in first, 'help should be shown'
+    second = cached_help(['first', '-h'])
+    assert second == first, 'cached help should be the same'
+    assert 'skaltemp' not in sys.modules, (
+        'cached help should not import the module')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_help_cache_main():
+    first = cached_help(['--help'])
+    assert 'first command' in first, 'help should list the commands'
+    assert cached_help(['--help']) == first, 'cached help should be the same'
+    assert 'skaltemp' not in sys.modules, (
+        'cached help should not import the module')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_help_cache_stale_module():
+    cached_help(['first', '-h'])
+    write_temp_module('changed command')
+    assert 'changed command' in cached_help(['first', '-h']), (
+        'help of a changed module should be rendered again')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_help_cache_changed_options():
+    cached_help(['-h'], description='first app')
+    assert 'second app' in cached_help(['-h'], description='second app'), (
+        'help of an app with other options should be rendered again')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_help_cache_changed_modules():
+    cached_help(['-h'])
+    output = cached_help(['-h'], subcommand_modules=[module])
+    assert module in output, (
+        'help of an app with other modules should be rendered again')
+
+
+def write_app_module(version):
+    with open(os.path.join(tempdir, 'skalappmod.py'), 'w') as f:
+        f.write("from skal import SkalApp\n\n\n"
+                "VERSION = %r\n\n\n"
+                "def create(cache):\n"
+                "    return SkalApp(command_modules=['skaltemp'],\n"
+                "                   description='app v' + VERSION,\n"
+                "                   version=VERSION, help_cache=cache)\n"
+                % version)
+    sys.modules.pop('skalappmod', None)
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_help_cache_changed_app_module():
+    cache = os.path.join(tempdir, 'help.json')
+    for version in ['1.0', '2.0']:
+        write_app_module(version)
+        import skalappmod
+        try:
+            skalappmod.create(cache).run(['-h'])
+        except SystemExit:
+            pass
+    assert 'app v2.0' in capture.stdout.getvalue(), (
+        'help of a changed app module should be rendered again')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_help_cache_error():
+    cache = os.path.join(tempdir, 'help.json')
+    try:
+        SkalApp(command_modules=['skaltemp'], help_cache=cache).run(
+            ['other', '-h'])
+    except SystemExit as e:
+        assert e.code == 2, 'exit code should be 2'
+    assert not os.path.exists(cache), 'errors should not be cached'
+
+
+# Result cache tests
+
+def write_cached_module(cache):
+    with open(os.path.join(tempdir, 'skalcached.py'), 'w') as f:
+        f.write("from skal import command\n\n\n"
+                "calls = []\n\n\n"
+                "@command({'-n': {}}, cache=%r)\n"
+                "def count(n):\n"
+                "    '''count calls'''\n"
+                "    n = int(n)\n"
+                "    calls.append(n)\n"
+                "    print('call %%d of %%s' %% (len(calls), n))\n"
+                "    return n if n < 0 else None\n" % cache)
+    sys.modules.pop('skalcached', None)
+
+
+def cached_app(**kwargs):
+    return SkalApp(command_modules=['skalcached'],
+                   result_cache=os.path.join(tempdir, 'results'), **kwargs)
+
+
+def cached_run(app, args):
+    result = app.run(args)
+    output = capture.stdout.getvalue()
+    capture.stop()
+    capture.start()
+    return result, output
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_result_cache_hit():
+    write_cached_module(60)
+    app = cached_app()
+    outputs = [cached_run(app, ['count', '-n', '1'])[1] for _ in range(2)]
+    assert outputs == ['call 1 of 1\n'] * 2, (
+        'cached output should be replayed')
+    assert sys.modules['skalcached'].calls == [1], (
+        'cached command should run once')
+    assert cached_run(app, ['count', '-n', '2'])[1] == 'call 2 of 2\n', (
+        'other arguments should run the command')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_result_cache_between_apps():
+    write_cached_module(True)
+    cached_run(cached_app(), ['count', '-n', '1'])
+    sys.modules.pop('skalcached', None)
+    result, output = cached_run(cached_app(static=True, lazy=True),
+                                ['count', '-n', '1'])
+    assert output == 'call 1 of 1\n', 'cache should be kept on disk'
+    assert 'skalcached' not in sys.modules, (
+        'cached command should not be imported')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_result_cache_no_cache():
+    write_cached_module(60)
+    app = cached_app()
+    cached_run(app, ['count', '-n', '1'])
+    result, output = cached_run(app, ['--no-cache', 'count', '-n', '1'])
+    assert output == 'call 2 of 1\n', '--no-cache should run the command'
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_result_cache_expired():
+    write_cached_module(0.01)
+    app = cached_app()
+    cached_run(app, ['count', '-n', '1'])
+    time.sleep(0.02)
+    result, output = cached_run(app, ['count', '-n', '1'])
+    assert output == 'call 2 of 1\n', 'expired results should not be used'
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_result_cache_failure():
+    write_cached_module(60)
+    app = cached_app()
+    for _ in range(2):
+        result, output = cached_run(app, ['count', '-n', '-1'])
+        assert result == -1, 'result should be returned'
+    assert sys.modules['skalcached'].calls == [-1, -1], (
+        'failing results should not be cached')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_result_cache_purge():
+    write_cached_module(60)
+    app = cached_app()
+    cached_run(app, ['count', '-n', '1'])
+    try:
+        app.run(['--purge-cache'])
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    assert os.listdir(os.path.join(tempdir, 'results')) == [], (
+        'results should be removed')
+
+
+class CachedApp(SkalApp):
+    """cached app"""
+
+    @command(cache=60)
+    def status(self):
+        """print status"""
+        print('%s status' % type(self).__name__)
+
+
+class OtherCachedApp(CachedApp):
+    """other cached app"""
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_result_cache_apps():
+    cache = os.path.join(tempdir, 'results')
+    for app in [CachedApp, OtherCachedApp]:
+        app(version='0.1', result_cache=cache).run(['status'])
+    assert capture.stdout.getvalue() == (
+        'CachedApp status\nOtherCachedApp status\n'), (
+        'commands of other apps should not share results')
+
+
+@with_setup(temp_setup, temp_teardown)
+def test_result_cache_eviction():
+    from skal.cache import ResultCache
+    cache = ResultCache(os.path.join(tempdir, 'results'))
+    paths = {}
+    for stamp, key in enumerate(['c', 'a', 'b']):
+        cache.put(key, 'x' * 100, '', None)
+        paths[key] = cache._ResultCache__file(key)
+        os.utime(paths[key], (stamp, stamp))
+    cache.size = sum(os.path.getsize(paths[key]) for key in 'ab')
+    cache.evict()
+    assert not os.path.exists(paths['c']), (
+        'least recently used result should be removed')
+    assert os.path.exists(paths['a']) and os.path.exists(paths['b']), (
+        'recently used results should be kept')
+
+
+# Timing tests
+
+def timings_setup():
+    timings.format = 'table'
+    capture.start()
+
+
+def timings_teardown():
+    capture.stop()
+    timings.format = None
+    timings.records = []
+
+
+@with_setup(timings_setup, timings_teardown)
+def test_timings_table():
+    sys.modules.pop(module, None)
+    SkalApp(command_modules=[module]).run(['first'])
+    lines = capture.stderr.getvalue().splitlines()
+    phases = [line.split()[0] for line in lines]
+    for phase in ['import', 'scan', 'parser', 'parse', 'command']:
+        assert phase in phases, 'timings should have the %s phase' % phase
+    assert any(line.endswith('  skalmodule') and line.startswith('import')
+               for line in lines), 'import should be timed per module'
+    assert any(line.endswith('  first') and line.startswith('command')
+               for line in lines), 'command should be timed per command'
+
+
+@with_setup(timings_setup, timings_teardown)
+def test_timings_json():
+    timings.format = 'json'
+    SkalApp(subcommand_modules=[module]).run([module, 'first'])
+    records = [json.loads(line) for line in
+               capture.stderr.getvalue().splitlines()
+               if line.startswith('{')]
+    parsers = [r for r in records if r['phase'] == 'parser']
+    assert ('first', 1) in [(r['name'], r['depth']) for r in parsers], (
+        'parsers of a module should be nested in the module parser')
+    assert all(r['wall'] >= 0 and r['cpu'] >= 0 for r in records), (
+        'times should be measured')
+
+
+def trace_setup():
+    temp_setup()
+    timings.format = 'table'
+    with open(os.path.join(tempdir, 'skalheavy.py'), 'w') as f:
+        f.write('value = 42\n')
+    with open(os.path.join(tempdir, 'skaltemp.py'), 'w') as f:
+        f.write("import os\n"
+                "import skalheavy\n"
+                "from skal import command\n")
+
+
+def trace_teardown():
+    timings_teardown()
+    sys.modules.pop('skalheavy', None)
+    capture.start()
+    temp_teardown()
+
+
+@with_setup(trace_setup, trace_teardown)
+def test_timings_imports():
+    try:
+        SkalApp(command_modules=['skaltemp']).run(['-h'])
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    lines = capture.stderr.getvalue().splitlines()
+    assert any(line.endswith('    skalheavy') and line.startswith('import')
+               for line in lines), (
+        'imports of a module should be timed nested in its import')
+    assert not any(line.endswith('    os') for line in lines), (
+        'modules already imported should not be timed')
+
+
+@with_setup(capture.start, capture.stop)
+def test_timings_disabled():
+    SkalApp(command_modules=[module]).run(['first'])
+    assert 'wall ms' not in capture.stderr.getvalue(), (
+        'timings should only be reported when enabled')
+
+
+# Lazy import tests
+
+@with_setup(temp_setup, temp_teardown)
+def test_lazy_import():
+    from skal import lazy_import
+    with open(os.path.join(tempdir, 'skalheavy.py'), 'w') as f:
+        f.write('value = 42\n')
+    try:
+        heavy = lazy_import('skalheavy')
+        assert 'skalheavy' not in sys.modules, (
+            'module should not be imported until used')
+        assert heavy.value == 42, 'module attributes should be used'
+        assert 'skalheavy' in sys.modules, 'module should be imported on use'
+    finally:
+        sys.modules.pop('skalheavy', None)
+
+
+def test_lazy_import_imported():
+    from skal import lazy_import
+    assert lazy_import('os') is os, 'imported module should be returned'
+
+
+@with_setup(capture.start, capture.stop)
+def test_lazy_import_error():
+    from skal import lazy_import
+    missing = lazy_import('skalmissing')
+    try:
+        missing.value
+    except ImportError:
+        pass
+    else:
+        assert False, 'import error should be raised on use'
@@ -13,6 +13,8 @@
 # limitations under the License.
 
 
+import sys
+
 from nose.tools import raises, with_setup
 
 from helpers import OutputCapture
@@ -24,3 +26,155 @@ capture = OutputCapture(debug=False)
 
 
 # --- Test cases --------------------------------------------------------------
+
+
+package = 'skalpackage'
+
+
+def unload():
+    for name in list(sys.modules):
+        if name == package or name.startswith(package + '.'):
+            del sys.modules[name]
+
+
+def package_setup():
+    unload()
+    capture.start()
+
+
+# Package as commands tests
+
+@with_setup(package_setup, capture.stop)
+def test_package_command_existing():
+    value = 'package_command'
+    args = [value]
+    SkalApp(command_packages=[package]).run(args)
+    assert value in capture.stdout.getvalue(), (
+        'output should contain "%s"' % value)
+
+
+@with_setup(package_setup, capture.stop)
+def test_package_module_command_existing():
+    value = 'first_command'
+    args = ['first', value]
+    SkalApp(command_packages=[package]).run(args)
+    assert value in capture.stdout.getvalue(), (
+        'output should contain "%s"' % value)
+
+
+@with_setup(package_setup, capture.stop)
+def test_package_module_command_argument():
+    args = ['second', 'second_command', '-i']
+    SkalApp(command_packages=[package]).run(args)
+    assert 'i\n' in capture.stdout.getvalue(), (
+        'output should contain "i"')
+
+
+@with_setup(package_setup, capture.stop)
+def test_package_help():
+    args = ['-h']
+    try:
+        SkalApp(command_packages=[package]).run(args)
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    for name in ['package_command', 'first', 'second', 'nested']:
+        assert name in capture.stdout.getvalue(), (
+            'help should list "%s"' % name)
+    assert 'first module' in capture.stdout.getvalue(), (
+        'help should contain module docs')
+
+
+@with_setup(package_setup, capture.stop)
+def test_package_import_error():
+    args = ['-h']
+    try:
+        SkalApp(command_packages=[package]).run(args)
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    assert 'ImportError' in capture.stderr.getvalue(), (
+        'output should contain ImportError')
+
+
+@with_setup(package_setup, capture.stop)
+def test_package_missing():
+    args = ['-h']
+    try:
+        SkalApp(command_packages=['missing_package']).run(args)
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    assert 'does not exist' in capture.stderr.getvalue(), (
+        'there should be a warning about package not existing')
+
+
+# Package as subcommands tests
+
+@with_setup(package_setup, capture.stop)
+def test_subpackage_command_existing():
+    value = 'package_command'
+    args = [package, value]
+    SkalApp(subcommand_packages=[package]).run(args)
+    assert value in capture.stdout.getvalue(), (
+        'output should contain "%s"' % value)
+
+
+@with_setup(package_setup, capture.stop)
+def test_subpackage_nested_command_existing():
+    value = 'deep_command'
+    args = [package, 'nested', 'deep', value]
+    SkalApp(subcommand_packages=[package]).run(args)
+    assert value in capture.stdout.getvalue(), (
+        'output should contain "%s"' % value)
+
+
+@with_setup(package_setup, capture.stop)
+def test_subpackage_doc():
+    args = [package, '-h']
+    try:
+        SkalApp(subcommand_packages=[package]).run(args)
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    assert 'package help string' in capture.stdout.getvalue(), (
+        'help should contain the package doc')
+    assert 'nested' in capture.stdout.getvalue(), (
+        'help should list the nested package')
+
+
+# Lazy package tests
+
+@with_setup(package_setup, capture.stop)
+def test_subpackage_nested_command_empty():
+    args = [package, 'nested', 'deep', '']
+    try:
+        SkalApp(subcommand_packages=[package]).run(args)
+    except SystemExit as e:
+        assert e.code != 0, 'exit code should not be 0'
+    assert 'deep_command' not in capture.stdout.getvalue(), (
+        'an empty command should not select the only command')
+
+
+@with_setup(package_setup, capture.stop)
+def test_lazy_package_imports_path_only():
+    value = 'deep_command'
+    args = [package, 'nested', 'deep', value]
+    SkalApp(subcommand_packages=[package], lazy=True).run(args)
+    assert value in capture.stdout.getvalue(), (
+        'output should contain "%s"' % value)
+    assert 'ImportError' not in capture.stderr.getvalue(), (
+        'modules off the command path should not be imported')
+    for name in ['first', 'second']:
+        assert package + '.' + name not in sys.modules, (
+            'module "%s" should not be imported' % name)
+
+
+@with_setup(package_setup, capture.stop)
+def test_lazy_package_help():
+    args = ['-h']
+    try:
+        SkalApp(command_packages=[package], lazy=True).run(args)
+    except SystemExit as e:
+        assert e.code == 0, 'exit code should be 0'
+    for name in ['package_command', 'first', 'second', 'nested']:
+        assert name in capture.stdout.getvalue(), (
+            'help should list "%s"' % name)
+    assert package + '.first' not in sys.modules, (
+        'modules should not be imported for the main help')
@@ -0,0 +1,283 @@
+# Copyright (c) 2012-2013 - Max Persson <max@looplab.se>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from nose.tools import with_setup
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import StringIO
+from helpers import OutputCapture
+from skal import SkalApp, command
+from skal import client
+from skal import server as server_module
+from skal.server import Server, ForkServer
+
+
+capture = OutputCapture(debug=False)
+tempdir = None
+server = None
+
+
+class ServedApp(SkalApp):
+    """served app"""
+
+    counter = 0
+
+    @command
+    def count(self):
+        """count calls"""
+        ServedApp.counter += 1
+        print(ServedApp.counter)
+
+    @command({
+        '-n': {'help': 'name to greet'}
+    })
+    def hello(self, n):
+        """say hello"""
+        print('hello %s' % n)
+
+    @command
+    def echo(self):
+        """echo stdin"""
+        for line in sys.stdin:
+            sys.stdout.write(line.upper())
+
+    @command
+    def cwd(self):
+        """print working directory"""
+        print(os.getcwd())
+
+    @command
+    def env(self):
+        """print environment"""
+        print(os.environ.get('SKAL_TEST', 'unset'))
+
+    @command
+    def true(self):
+        """return true"""
+        return True
+
+    @command
+    def fail(self):
+        """raise error"""
+        raise ValueError('failing command')
+
+
+def server_setup():
+    global tempdir, server
+    tempdir = tempfile.mkdtemp()
+    server = Server(ServedApp(version='0.1'), os.path.join(tempdir, 'sock'))
+    capture.start()
+
+
+def server_teardown():
+    capture.stop()
+    server.close()
+    shutil.rmtree(tempdir)
+
+
+def fork_server_setup():
+    global tempdir, server
+    tempdir = tempfile.mkdtemp()
+    server = ForkServer(ServedApp, os.path.join(tempdir, 'sock'))
+    capture.start()
+
+
+def fork_call(args, stdin=''):
+    # The fork server forks in the main thread, the client runs in another
+    result = {}
+
+    def target():
+        stdout = StringIO.StringIO()
+        stderr = StringIO.StringIO()
+        result['code'] = client.call(
+            server.path, args, stdin=StringIO.StringIO(stdin),
+            stdout=stdout, stderr=stderr)
+        result['stdout'] = stdout.getvalue()
+        result['stderr'] = stderr.getvalue()
+    thread = threading.Thread(target=target)
+    thread.start()
+    server.handle_request()
+    thread.join()
+    return result['code'], result['stdout'], result['stderr']
+
+
+def call(args, stdin='', **kwargs):
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    stdout = StringIO.StringIO()
+    stderr = StringIO.StringIO()
+    code = client.call(server.path, args, stdin=StringIO.StringIO(stdin),
+                       stdout=stdout, stderr=stderr, **kwargs)
+    thread.join()
+    return code, stdout.getvalue(), stderr.getvalue()
+
+
+# --- Test cases --------------------------------------------------------------
+
+
+@with_setup(server_setup, server_teardown)
+def test_command_output():
+    code, stdout, stderr = call(['hello', '-n', 'world'])
+    assert code == 0, 'exit code should be 0'
+    assert stdout == 'hello world\n', 'output should be relayed'
+
+
+@with_setup(server_setup, server_teardown)
+def test_command_repeated():
+    for name in ['first', 'second']:
+        code, stdout, stderr = call(['hello', '-n', name])
+        assert stdout == 'hello %s\n' % name, (
+            'each request should run with its own arguments')
+
+
+@with_setup(server_setup, server_teardown)
+def test_command_non_existing():
+    code, stdout, stderr = call(['other'])
+    assert code != 0, 'exit code should not be 0'
+    assert 'invalid choice' in stderr, 'errors should be relayed'
+
+
+@with_setup(server_setup, server_teardown)
+def test_command_help():
+    code, stdout, stderr = call(['-h'])
+    assert code == 0, 'exit code should be 0'
+    assert 'say hello' in stdout, 'help should be relayed'
+
+
+@with_setup(server_setup, server_teardown)
+def test_command_exception():
+    code, stdout, stderr = call(['fail'])
+    assert code == 1, 'exit code should be 1'
+    assert 'failing command' in stderr, 'traceback should be relayed'
+
+
+@with_setup(server_setup, server_teardown)
+def test_command_bool():
+    code, stdout, stderr = call(['true'])
+    assert code == 1, 'exit code of True should be 1'
+
+
+@with_setup(server_setup, server_teardown)
+def test_stdin():
+    code, stdout, stderr = call(['echo'], stdin='a\nb\n')
+    assert stdout == 'A\nB\n', 'input should be relayed'
+
+
+@with_setup(server_setup, server_teardown)
+def test_cwd():
+    code, stdout, stderr = call(['cwd'], cwd=tempdir)
+    assert stdout.strip() == os.path.realpath(tempdir), (
+        'command should run in the client directory')
+    assert os.getcwd() != os.path.realpath(tempdir), (
+        'server directory should be restored')
+
+
+@with_setup(server_setup, server_teardown)
+def test_env():
+    code, stdout, stderr = call(['env'], env={'SKAL_TEST': 'set'})
+    assert stdout == 'set\n', 'command should run in the client environment'
+    assert 'SKAL_TEST' not in os.environ, (
+        'server environment should be restored')
+
+
+@with_setup(server_setup, server_teardown)
+def test_interrupt_after_command():
+    # The interrupt of a client leaving lands after the command is run
+    def run(app, args):
+        while True:
+            time.sleep(0.01)
+
+    def target():
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(server.path)
+        client.send(sock, 'a', json.dumps({
+            'argv': ['count'], 'cwd': os.getcwd(), 'env': {}}))
+        time.sleep(0.05)
+        sock.close()
+    original = server_module._run
+    server_module._run = run
+    try:
+        thread = threading.Thread(target=target)
+        thread.start()
+        server.handle_request()
+        thread.join()
+    except KeyboardInterrupt:
+        assert False, 'interrupt of a client should not stop the server'
+    finally:
+        server_module._run = original
+    assert sys.stdout is capture.stdout and 'HOME' in os.environ, (
+        'server state should be restored')
+
+
+@with_setup(server_setup, server_teardown)
+def test_stats():
+    call(['hello', '-n', 'world'])
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    stats = client.stats(server.path)
+    thread.join()
+    assert stats['requests'] == 1, 'stats should count requests'
+
+
+# Fork server tests
+
+@with_setup(fork_server_setup, server_teardown)
+def test_fork_command_output():
+    code, stdout, stderr = fork_call(['hello', '-n', 'world'])
+    assert code == 0, 'exit code should be 0'
+    assert stdout == 'hello world\n', 'output should be relayed'
+
+
+@with_setup(fork_server_setup, server_teardown)
+def test_fork_exit_code():
+    code, stdout, stderr = fork_call(['fail'])
+    assert code == 1, 'exit code should be 1'
+    assert 'failing command' in stderr, 'traceback should be relayed'
+
+
+@with_setup(fork_server_setup, server_teardown)
+def test_fork_stdin():
+    code, stdout, stderr = fork_call(['echo'], stdin='a\nb\n')
+    assert stdout == 'A\nB\n', 'input should be relayed'
+
+
+@with_setup(fork_server_setup, server_teardown)
+def test_fork_isolated():
+    for _ in range(2):
+        code, stdout, stderr = fork_call(['count'])
+        assert stdout == '1\n', 'state should not leak between requests'
+    assert ServedApp.counter == 0, 'server state should stay pristine'
+
+
+@with_setup(fork_server_setup, server_teardown)
+def test_fork_stats():
+    fork_call(['hello', '-n', 'world'])
+    stats = {}
+
+    def target():
+        stats.update(client.stats(server.path))
+    thread = threading.Thread(target=target)
+    thread.start()
+    server.handle_request()
+    thread.join()
+    assert stats['forks'] == 1, 'stats should count forks'
+    assert stats['startup'] > 0, 'stats should have the startup time'
+    assert 'fork_time' in stats, 'stats should have the fork time'